@@ -5,6 +5,9 @@ import sys
 
 BASE_DIR = '/user_data/csimmon2/long_pt'
 
+# Environment (incl. FSLDIR/FSLOUTPUTTYPE) captured once and reused for every FSL call
+FSL_ENV = os.environ.copy()
+
 # Start/Anchor sessions
 # Default is '01', these are the exceptions
 SESSION_START = {
@@ -63,11 +66,12 @@ def register_subject(sub):
                 
             print(f"    Registering {run_name}...")
             try:
-                cmd_concat = f"convert_xfm -omat {combined_mat} -concat {anat_transform} {func2anat}"
-                subprocess.run(cmd_concat, shell=True, check=True)
+                cmd_concat = ["convert_xfm", "-omat", combined_mat, "-concat", anat_transform, func2anat]
+                subprocess.run(cmd_concat, check=True, env=FSL_ENV)
                 
-                cmd_apply = f"flirt -in {func_4d} -ref {ref_brain} -out {output_4d} -applyxfm -init {combined_mat} -interp trilinear"
-                subprocess.run(cmd_apply, shell=True, check=True)
+                cmd_apply = ["flirt", "-in", func_4d, "-ref", ref_brain, "-out", output_4d,
+                             "-applyxfm", "-init", combined_mat, "-interp", "trilinear"]
+                subprocess.run(cmd_apply, check=True, env=FSL_ENV)
                 
             except subprocess.CalledProcessError as e:
                 print(f"    ❌ Failed: {e}")
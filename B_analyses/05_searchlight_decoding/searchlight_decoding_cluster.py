@@ -7,20 +7,38 @@ More discriminative than category vs scramble.
 """
 
 import os
+
+# One BLAS thread per process: parallelism comes from the searchlight pool,
+# nested BLAS threads inside each SVM fit would only oversubscribe the node
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('MKL_NUM_THREADS', '1')
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+
 import sys
 import argparse
+import functools
+import gzip
+import itertools
+import shutil
 import numpy as np
 import nibabel as nib
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from scipy.linalg import cho_factor, cho_solve
 from scipy.ndimage import label
-from sklearn.svm import SVC
-from sklearn.model_selection import cross_val_score, LeaveOneGroupOut
-from sklearn.preprocessing import StandardScaler
+from sklearn.svm import LinearSVC
 import json
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -56,6 +74,18 @@ HRF_DELAY = 4
 SL_RADIUS = 6
 ACCURACY_THRESHOLD = 0.55
 
+# Ridge penalty for the searchlight classifier, relative to the mean feature energy
+RIDGE_ALPHA = 1e-3
+
+# Worker processes per searchlight (SLURM allocation if present, else all cores)
+SL_POOL_SIZE = int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count() or 1))
+SL_CHUNK = 256  # spheres per worker task (one Morton tile)
+FUNC_READ_VOLS = 32  # volumes per dataobj read when compressing a run
+
+# Optional CUDA searchlight (needs PyTorch); spheres per batched solve
+SL_USE_GPU = os.environ.get('SL_USE_GPU', '0') == '1'
+SL_GPU_BATCH = 1024
+
 SESSION_ANCHOR_EXCEPTIONS = {
     'sub-010': '02',
     'sub-018': '02',
@@ -90,6 +120,7 @@ def get_sessions(sub):
 # Data Loading
 # ============================================================================
 
+@functools.lru_cache(maxsize=None)
 def get_available_runs(sub, ses):
     func_base = BASE_DIR / sub / f'ses-{ses}' / 'derivatives' / 'fsl' / 'loc'
     runs = []
@@ -97,10 +128,11 @@ def get_available_runs(sub, ses):
         func_file = run_dir / '1stLevel.feat' / 'filtered_func_data_reg.nii.gz'
         if func_file.exists():
             runs.append(run_dir.name)
-    return runs
+    return tuple(runs)
 
 
 def load_functional_data(sub, ses, run, use_registered=False):
+    """NIfTI image of a run's filtered data; voxels are read lazily through img.dataobj."""
     func_dir = (BASE_DIR / sub / f'ses-{ses}' / 'derivatives' / 'fsl' / 'loc' /
                 run / '1stLevel.feat')
     anchor_ses, comp_ses = get_sessions(sub)
@@ -116,142 +148,445 @@ def load_functional_data(sub, ses, run, use_registered=False):
     if not func_file.exists():
         return None, None
     img = nib.load(func_file)
-    return img.get_fdata(), img.affine
+    return img, img.affine
+
+
+def load_func_compressed(sub, ses, run, hemi, use_registered=False):
+    """Mask-compressed (n_hemi_voxels, T) float32 run data, cached as a memory-mapped .npy.
+    
+    Rows cover the union of all category ROIs of the hemisphere (see
+    load_hemi_voxels), so each run is decoded from NIfTI once and every
+    comparison takes its own rows from the same cache. The voxel indices are
+    stored next to the data, and the cache is only reused if they match.
+    """
+    hemi_mask, voxels = load_hemi_voxels(sub, hemi)
+    if hemi_mask is None:
+        return None
+    reg = '_reg' if use_registered else ''
+    cache_file = OUTPUT_DIR / '_cache' / f'{sub}_ses-{ses}_{run}_{hemi}{reg}_func.npy'
+    voxels_file = cache_file.with_name(cache_file.name.replace('_func.npy', '_voxels.npy'))
+    if cache_file.exists() and voxels_file.exists():
+        if np.array_equal(np.load(voxels_file), voxels):
+            return np.load(cache_file, mmap_mode='r')
+    
+    img, _ = load_functional_data(sub, ses, run, use_registered=use_registered)
+    if img is None:
+        return None
+    
+    # Stream the run a few volumes at a time straight into the compressed array,
+    # so the full 4D volume is never resident (let alone as float64)
+    n_vols = img.shape[-1]
+    func_2d = np.empty((voxels.size, n_vols), dtype=np.float32)
+    for lo in range(0, n_vols, FUNC_READ_VOLS):
+        hi = min(lo + FUNC_READ_VOLS, n_vols)
+        func_2d[:, lo:hi] = np.asarray(img.dataobj[..., lo:hi], dtype=np.float32)[hemi_mask]
+    
+    # Data first, voxel list last: a run is only trusted once both are in place
+    _atomic_write(cache_file, lambda f: np.save(f, func_2d))
+    _atomic_write(voxels_file, lambda f: np.save(f, voxels))
+    return np.load(cache_file, mmap_mode='r')
+
 
+@functools.lru_cache(maxsize=None)
+def _list_timing_files(sub, ses):
+    """Names of all timing files for a session, read with a single scandir."""
+    timing_dir = BASE_DIR / sub / f'ses-{ses}' / 'timing'
+    if not timing_dir.is_dir():
+        return frozenset()
+    with os.scandir(timing_dir) as entries:
+        return frozenset(entry.name for entry in entries)
 
+
+@functools.lru_cache(maxsize=None)
 def load_timing(sub, ses, run, category):
+    """Parsed timing file (read-only, shared between comparisons), or None."""
     sub_num = sub.replace('sub-', '')
-    timing_file = BASE_DIR / sub / f'ses-{ses}' / 'timing' / f'catloc_{sub_num}_{run}_{category}.txt'
-    if timing_file.exists():
-        return np.loadtxt(timing_file)
+    timing_name = f'catloc_{sub_num}_{run}_{category}.txt'
+    if timing_name in _list_timing_files(sub, ses):
+        timing = np.loadtxt(BASE_DIR / sub / f'ses-{ses}' / 'timing' / timing_name)
+        timing.flags.writeable = False
+        return timing
     return None
 
 
+@functools.lru_cache(maxsize=None)
+def _load_roi_mask(sub, hemi, category):
+    """Anchor-session search mask of one category (read-only) and its affine."""
+    anchor_ses, _ = get_sessions(sub)
+    mask_file = (BASE_DIR / sub / f'ses-{anchor_ses}' / 'ROIs' / 
+                 f'{hemi}_{category.lower()}_searchmask.nii.gz')
+    if not mask_file.exists():
+        return None, None
+    img = nib.load(mask_file)
+    mask = np.asanyarray(img.dataobj) > 0
+    mask.flags.writeable = False
+    return mask, img.affine
+
+
 def load_mask(sub, ses, hemi, categories):
     """Load union of masks for both categories in comparison."""
-    anchor_ses, _ = get_sessions(sub)
-    
     masks = []
     affine = None
     for cat in categories:
-        mask_file = (BASE_DIR / sub / f'ses-{anchor_ses}' / 'ROIs' / 
-                     f'{hemi}_{cat.lower()}_searchmask.nii.gz')
-        if mask_file.exists():
-            img = nib.load(mask_file)
-            masks.append(img.get_fdata() > 0)
+        mask, cat_affine = _load_roi_mask(sub, hemi, cat)
+        if mask is not None:
+            masks.append(mask)
             if affine is None:
-                affine = img.affine
+                affine = cat_affine
     
     if not masks:
         return None, None
     
-    # Union of masks
-    union_mask = masks[0]
-    for m in masks[1:]:
-        union_mask = union_mask | m
+    # Union of masks (single C-level reduction, no per-mask intermediates)
+    union_mask = np.logical_or.reduce(masks)
     
     return union_mask, affine
 
 
+@functools.lru_cache(maxsize=None)
+def load_hemi_voxels(sub, hemi):
+    """Union of all category ROIs of a hemisphere and its flat voxel indices (read-only).
+    
+    Every comparison mask is a subset of this, so it is the row set of the
+    per-run cache in load_func_compressed.
+    """
+    anchor_ses, _ = get_sessions(sub)
+    hemi_mask, _ = load_mask(sub, anchor_ses, hemi, CATEGORIES)
+    if hemi_mask is None:
+        return None, None
+    voxels = np.flatnonzero(hemi_mask)
+    hemi_mask.flags.writeable = False
+    voxels.flags.writeable = False
+    return hemi_mask, voxels
+
+
 # ============================================================================
 # Pattern Extraction
 # ============================================================================
 
-def extract_blocks(func_data, timing, tr=TR, hrf_delay=HRF_DELAY):
-    patterns = []
-    for onset, duration, _ in timing:
-        start_vol = int((onset + hrf_delay) / tr)
-        end_vol = int((onset + duration + hrf_delay) / tr)
-        end_vol = min(end_vol, func_data.shape[-1])
-        if start_vol < end_vol:
-            patterns.append(np.mean(func_data[..., start_vol:end_vol], axis=-1))
-    return np.array(patterns) if patterns else None
+if HAVE_NUMBA:
+    @njit(cache=True)
+    def _sphere_design_nb(X, rows):
+        """Gather sphere rows of (n_voxels, n) patterns into an (n, voxels + 1) matrix."""
+        n = X.shape[1]
+        out = np.empty((n, rows.shape[0] + 1))
+        for v in range(rows.shape[0]):
+            for s in range(n):
+                out[s, v] = X[rows[v], s]
+        out[:, rows.shape[0]] = 1.0
+        return out
+
+
+def extract_blocks(func_2d, timing, tr=TR, hrf_delay=HRF_DELAY):
+    """Block-mean patterns of mask-compressed (n_voxels, T) data -> (n_voxels, n_blocks)."""
+    timing = np.atleast_2d(timing)
+    starts = ((timing[:, 0] + hrf_delay) / tr).astype(np.int64)
+    ends = np.minimum(((timing[:, 0] + timing[:, 1] + hrf_delay) / tr).astype(np.int64),
+                      func_2d.shape[-1])
+    keep = starts < ends
+    if not keep.any():
+        return None
+    starts, ends = starts[keep], ends[keep]
+    
+    # (T, n_blocks) membership matrix with 1/len(block) weights: all block
+    # means come out of one GEMM that streams each timeseries once
+    t = np.arange(func_2d.shape[-1])[:, None]
+    W = ((t >= starts) & (t < ends)) / (ends - starts).astype(np.float32)
+    return func_2d @ W
 
 
-def extract_pairwise_patterns(sub, ses, cat1, cat2, hemi, use_registered=False):
-    """Extract patterns for two categories."""
+def extract_pairwise_patterns(sub, ses, cat1, cat2, hemi, mask_data, use_registered=False):
+    """Extract patterns for two categories.
+    
+    Patterns are stored voxels x samples over the mask voxels only
+    (float32, C-contiguous), so a searchlight sphere is a gather of rows.
+    """
     runs = get_available_runs(sub, ses)
     all_patterns, all_labels, all_runs = [], [], []
     
+    # Rows of this comparison's mask within the hemisphere-wide run cache
+    _, hemi_voxels = load_hemi_voxels(sub, hemi)
+    voxels = np.flatnonzero(mask_data)
+    rows = np.searchsorted(hemi_voxels, voxels)
+    if rows.size and (rows[-1] >= hemi_voxels.size or
+                      not np.array_equal(hemi_voxels[rows], voxels)):
+        raise ValueError(f"{sub} {hemi} {cat1}-{cat2} mask is not within the hemisphere ROI union")
+    
     for run in runs:
-        func_data, _ = load_functional_data(sub, ses, run, use_registered=use_registered)
-        if func_data is None:
+        func_hemi = load_func_compressed(sub, ses, run, hemi, use_registered=use_registered)
+        if func_hemi is None:
             continue
+        func_2d = func_hemi[rows]
         run_num = int(run.split('-')[1])
         
         for cat_idx, cat in enumerate([cat1, cat2]):
             timing = load_timing(sub, ses, run, cat)
             if timing is None:
                 continue
-            patterns = extract_blocks(func_data, timing)
+            patterns = extract_blocks(func_2d, timing)
             if patterns is None:
                 continue
-            for p in patterns:
-                all_patterns.append(p)
-                all_labels.append(cat_idx)
-                all_runs.append(run_num)
+            all_patterns.append(patterns)
+            all_labels.extend([cat_idx] * patterns.shape[1])
+            all_runs.extend([run_num] * patterns.shape[1])
     
     if not all_patterns:
         return None, None, None
-    return np.array(all_patterns), np.array(all_labels), np.array(all_runs)
+    X = np.ascontiguousarray(np.concatenate(all_patterns, axis=1), dtype=np.float32)
+    return X, np.array(all_labels), np.array(all_runs)
 
 
 # ============================================================================
 # Searchlight Functions
 # ============================================================================
 
-def svm_cv(data, sl_mask, myrad, bcvar):
-    y, groups = bcvar
-    bold = data[0].reshape(-1, data[0].shape[-1]).T
-    if bold.shape[1] < 5:
+def build_sphere_index(mask_data, radius=SL_RADIUS):
+    """Searchlight neighbourhoods of every mask voxel as CSR arrays.
+    
+    Returns (centers, indptr, indices): centers are the flat volume indices of
+    the mask voxels (C order, the same order as the pattern rows) and sphere c
+    covers pattern rows indices[indptr[c]:indptr[c + 1]]. Radius is in voxels,
+    as BrainIAK's sl_rad was.
+    """
+    r = int(radius)
+    offsets = np.mgrid[-r:r + 1, -r:r + 1, -r:r + 1].reshape(3, -1).T
+    offsets = offsets[(offsets ** 2).sum(axis=1) <= radius ** 2]
+    
+    coords = np.argwhere(mask_data)
+    row_of = np.full(mask_data.shape, -1, dtype=np.int32)
+    row_of[mask_data] = np.arange(len(coords), dtype=np.int32)
+    
+    # (n_centers, n_offsets) table of neighbour rows, -1 outside the mask/volume
+    shape = np.array(mask_data.shape)
+    neighbours = np.full((len(coords), len(offsets)), -1, dtype=np.int32)
+    for j, off in enumerate(offsets):
+        nb = coords + off
+        inside = np.all((nb >= 0) & (nb < shape), axis=1)
+        neighbours[inside, j] = row_of[tuple(nb[inside].T)]
+    
+    valid = neighbours >= 0
+    indptr = np.concatenate([[0], np.cumsum(valid.sum(axis=1))]).astype(np.int64)
+    indices = neighbours[valid]
+    centers = np.flatnonzero(mask_data)
+    return centers, indptr, indices
+
+
+def _atomic_write(path, write):
+    """Call write(f) on a per-process temp file, then move it into place.
+    
+    Concurrent array tasks never see a half-written cache file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.part')
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def load_sphere_index(sub, ses, hemi, comp_name, mask_data, radius=SL_RADIUS):
+    """build_sphere_index, cached on disk per subject/session/hemisphere/comparison mask."""
+    cache_file = (OUTPUT_DIR / '_cache' /
+                  f'{sub}_ses-{ses}_{hemi}_{comp_name.lower()}_r{radius}_sphere_idx.npz')
+    if cache_file.exists():
+        with np.load(cache_file) as cached:
+            # Only trust the cache if it was built from the same mask
+            if np.array_equal(cached['centers'], np.flatnonzero(mask_data)):
+                return cached['centers'], cached['indptr'], cached['indices']
+    
+    centers, indptr, indices = build_sphere_index(mask_data, radius)
+    _atomic_write(cache_file, lambda f: np.savez(f, centers=centers, indptr=indptr,
+                                                 indices=indices))
+    return centers, indptr, indices
+
+
+def morton_order(centers, shape):
+    """Permutation of flat voxel indices sorting them along a 3D Z-order curve."""
+    code = np.zeros(len(centers), dtype=np.uint64)
+    for axis, c in enumerate(np.unravel_index(centers, shape)):
+        c = c.astype(np.uint64)
+        for bit in range(10):
+            code |= ((c >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis)
+    return np.argsort(code, kind='stable')
+
+
+_SL_STATE = {}
+
+
+def _sl_worker_init(kernel, data, indptr, indices):
+    _SL_STATE.update(kernel=kernel, data=data, indptr=indptr, indices=indices)
+
+
+def _sl_run_chunk(spheres):
+    kernel, data = _SL_STATE['kernel'], _SL_STATE['data']
+    indptr, indices = _SL_STATE['indptr'], _SL_STATE['indices']
+    return [kernel(indices[indptr[c]:indptr[c + 1]], *data) for c in spheres]
+
+
+def map_spheres(kernel, data, sphere_index, mask_data):
+    """Evaluate kernel(rows, *data) for every sphere; returns a NaN-padded volume.
+    
+    Spheres are visited in Morton order and handed out in contiguous tiles,
+    so the spheres a worker evaluates back to back overlap heavily and
+    their pattern rows stay in cache.
+    """
+    centers, indptr, indices = sphere_index
+    order = morton_order(centers, mask_data.shape)
+    tiles = [order[lo:lo + SL_CHUNK] for lo in range(0, len(order), SL_CHUNK)]
+    init = (kernel, data, indptr, indices)
+    
+    if SL_POOL_SIZE > 1:
+        with Pool(SL_POOL_SIZE, initializer=_sl_worker_init, initargs=init) as pool:
+            chunks = pool.map(_sl_run_chunk, tiles)
+    else:
+        _sl_worker_init(*init)
+        chunks = [_sl_run_chunk(t) for t in tiles]
+    
+    acc_map = np.full(mask_data.shape, np.nan, dtype=np.float32)
+    acc_map.ravel()[centers[order]] = np.concatenate(chunks)
+    return acc_map
+
+
+def sphere_design(X, rows):
+    """(n_samples, n_voxels + 1) float64 design matrix of one sphere, intercept last."""
+    if HAVE_NUMBA:
+        return _sphere_design_nb(X, rows)
+    design = np.ones((X.shape[1], len(rows) + 1))
+    design[:, :-1] = X[rows].T
+    return design
+
+
+def logo_splits(groups):
+    """Leave-one-run-out (train, test) index pairs, computed once per searchlight."""
+    return tuple((np.flatnonzero(groups != g), np.flatnonzero(groups == g))
+                 for g in np.unique(groups))
+
+
+def fast_linear_cv(X, t, splits, alpha=RIDGE_ALPHA):
+    """Leave-one-run-out accuracy of a closed-form ridge classifier.
+    
+    X is a design matrix from sphere_design, t the -1/+1 targets and splits
+    the folds from logo_splits. The ridge is solved in its dual form: the
+    (samples x samples) Gram matrix is formed once, and each fold slices its
+    training block out of it and does one Cholesky solve. Spheres have far
+    more voxels than samples, so this is much smaller than the primal system.
+    """
+    G = X @ X.T
+    # BOLD is not standardized here, so scale the penalty to the data
+    lam = alpha * np.trace(G) / X.shape[1]
+    
+    fold_acc = []
+    for train, test in splits:
+        G_train = G[np.ix_(train, train)]
+        G_train.flat[::G_train.shape[0] + 1] += lam
+        a = cho_solve(cho_factor(G_train), t[train])
+        fold_acc.append(np.mean((G[np.ix_(test, train)] @ a > 0) == (t[test] > 0)))
+    return np.mean(fold_acc)
+
+
+def svm_cv(rows, X, t, splits):
+    if len(rows) < 5:
         return 0.5
     try:
-        clf = SVC(kernel='linear')
-        cv = LeaveOneGroupOut()
-        return np.mean(cross_val_score(clf, bold, y, cv=cv, groups=groups))
+        return fast_linear_cv(sphere_design(X, rows), t, splits)
     except:
         return 0.5
 
 
-def run_searchlight(X, y, runs, mask_data):
+def gpu_linear_cv(X, t, splits, sphere_index, alpha=RIDGE_ALPHA, batch=SL_GPU_BATCH):
+    """fast_linear_cv for every sphere at once, as batched float64 solves on CUDA.
+    
+    Spheres are padded to the largest one with an all-zero pattern row, which
+    adds nothing to their Gram matrices; the intercept column is the +1.
+    """
+    import torch
+    dev = torch.device('cuda')
+    centers, indptr, indices = sphere_index
+    counts = np.diff(indptr)
+    max_vox = counts.max()
+    
+    pad = np.full((len(centers), max_vox), X.shape[0], dtype=np.int64)
+    pad[np.arange(max_vox) < counts[:, None]] = indices
+    P = torch.zeros((X.shape[0] + 1, X.shape[1]), dtype=torch.float64, device=dev)
+    P[:-1] = torch.from_numpy(np.asarray(X, dtype=np.float64))
+    tt = torch.from_numpy(t).to(dev)
+    folds = [(torch.from_numpy(tr).to(dev), torch.from_numpy(te).to(dev)) for tr, te in splits]
+    
+    acc = np.empty(len(centers))
+    for lo in range(0, len(centers), batch):
+        B = P[torch.from_numpy(pad[lo:lo + batch]).to(dev)]  # (b, max_vox, n)
+        G = B.transpose(1, 2) @ B + 1.0
+        d = torch.from_numpy(counts[lo:lo + batch] + 1).to(dev)
+        lam = alpha * torch.diagonal(G, dim1=1, dim2=2).sum(dim=1) / d
+        
+        fold_acc = []
+        failed = torch.zeros(len(G), dtype=torch.bool, device=dev)
+        for tr, te in folds:
+            eye = torch.eye(len(tr), dtype=torch.float64, device=dev)
+            L, info = torch.linalg.cholesky_ex(G[:, tr][:, :, tr] + lam[:, None, None] * eye)
+            a = torch.cholesky_solve(tt[tr].expand(len(G), -1).unsqueeze(-1), L)
+            pred = (G[:, te][:, :, tr] @ a)[..., 0]
+            fold_acc.append(((pred > 0) == (tt[te] > 0)).double().mean(dim=1))
+            failed |= info != 0
+        
+        # Same fallbacks as svm_cv: failed solves score chance
+        res = torch.stack(fold_acc).mean(dim=0)
+        res[failed] = 0.5
+        acc[lo:lo + batch] = res.cpu().numpy()
+    
+    acc[counts < 5] = 0.5
+    return acc
+
+
+def _cuda_available():
     try:
-        from brainiak.searchlight.searchlight import Searchlight, Ball
+        import torch
     except ImportError:
-        print("ERROR: BrainIAK not available")
-        return None
+        return False
+    return torch.cuda.is_available()
+
+
+def run_searchlight(X, y, runs, mask_data, sphere_index):
+    # Targets and folds are the same for every sphere: build them once
+    t = np.where(y == 1, 1.0, -1.0)
+    splits = logo_splits(runs)
+    
+    if SL_USE_GPU:
+        if _cuda_available():
+            acc_map = np.full(mask_data.shape, np.nan, dtype=np.float32)
+            acc_map.ravel()[sphere_index[0]] = gpu_linear_cv(X, t, splits, sphere_index)
+            return acc_map
+        print("  Warning: SL_USE_GPU set but no CUDA device, using CPU workers")
     
-    sl = Searchlight(sl_rad=SL_RADIUS, max_blk_edge=5, shape=Ball)
-    sl.distribute([np.transpose(X, (1, 2, 3, 0))], mask_data.astype(int))
-    sl.broadcast((y, runs))
-    return np.array(sl.run_searchlight(svm_cv, pool_size=1), dtype=float)
+    return map_spheres(svm_cv, (X, t, splits), sphere_index, mask_data)
 
 
-def svm_cross_temporal(data, sl_mask, myrad, bcvar):
-    y1, y2 = bcvar
-    bold1 = data[0].reshape(-1, data[0].shape[-1]).T
-    bold2 = data[1].reshape(-1, data[1].shape[-1]).T
-    if bold1.shape[1] < 5:
+def svm_cross_temporal(rows, X1, X2, y1, y2):
+    if len(rows) < 5:
         return 0.5
+    # The row gathers are private (samples, voxels) copies, so scaling can happen in place
+    bold1 = np.ascontiguousarray(X1[rows].T)
+    bold2 = np.ascontiguousarray(X2[rows].T)
     try:
-        scaler = StandardScaler()
-        clf = SVC(kernel='linear')
-        clf.fit(scaler.fit_transform(bold1), y1)
-        return clf.score(scaler.transform(bold2), y2)
+        # Standardize both sessions with the training-session mean/std, in place
+        mu = bold1.mean(axis=0, dtype=np.float32)
+        sigma = bold1.std(axis=0, dtype=np.float32)
+        sigma[sigma == 0] = 1.0
+        for bold in (bold1, bold2):
+            np.subtract(bold, mu, out=bold)
+            np.divide(bold, sigma, out=bold)
+        clf = LinearSVC(C=1.0, loss='squared_hinge', dual=True, tol=1e-3, max_iter=200)
+        clf.fit(bold1, y1)
+        return clf.score(bold2, y2)
     except:
         return 0.5
 
 
-def run_cross_temporal_searchlight(X1, y1, X2, y2, mask_data):
-    try:
-        from brainiak.searchlight.searchlight import Searchlight, Ball
-    except ImportError:
-        return None
-    
-    sl = Searchlight(sl_rad=SL_RADIUS, max_blk_edge=5, shape=Ball)
-    sl.distribute([np.transpose(X1, (1, 2, 3, 0)), np.transpose(X2, (1, 2, 3, 0))], 
-                  mask_data.astype(int))
-    sl.broadcast((y1, y2))
-    return np.array(sl.run_searchlight(svm_cross_temporal, pool_size=1), dtype=float)
+def run_cross_temporal_searchlight(X1, y1, X2, y2, mask_data, sphere_index):
+    return map_spheres(svm_cross_temporal, (X1, X2, y1, y2), sphere_index, mask_data)
 
 
 # ============================================================================
@@ -259,35 +594,85 @@ def run_cross_temporal_searchlight(X1, y1, X2, y2, mask_data):
 # ============================================================================
 
 def compute_region_stats(acc_map, mask_data, threshold=ACCURACY_THRESHOLD):
-    acc_masked = acc_map.copy()
-    acc_masked[~mask_data] = np.nan
+    acc_in = acc_map[mask_data]
     
-    above_thresh = (acc_masked > threshold) & mask_data
-    vol = int(np.sum(above_thresh))
+    # One bool temporary: threshold, then mask in place (NaN compares False)
+    above_thresh = acc_map > threshold
+    np.logical_and(above_thresh, mask_data, out=above_thresh)
+    vol = int(np.count_nonzero(above_thresh))
     
     labeled, n_clusters = label(above_thresh)
-    largest_cluster = 0
-    if n_clusters > 0:
-        cluster_sizes = [np.sum(labeled == i) for i in range(1, n_clusters + 1)]
-        largest_cluster = max(cluster_sizes)
+    # One pass over the label volume instead of one per cluster
+    cluster_sizes = np.bincount(labeled.ravel())[1:]
+    largest_cluster = cluster_sizes.max() if cluster_sizes.size else 0
     
     return {
         'volume_above_thresh': vol,
         'n_clusters': int(n_clusters),
         'largest_cluster': int(largest_cluster),
-        'peak_accuracy': float(np.nanmax(acc_masked)),
-        'mean_accuracy': float(np.nanmean(acc_masked[mask_data]))
+        'peak_accuracy': float(np.nanmax(acc_in)),
+        'mean_accuracy': float(np.nanmean(acc_in, dtype=np.float32))
     }
 
 
+# Set bits per byte value, for popcounts over packed masks
+_POPCOUNT8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
 def compute_dice(map1, map2, mask, threshold=ACCURACY_THRESHOLD):
-    bin1 = (map1 > threshold) & mask
-    bin2 = (map2 > threshold) & mask
-    intersection = np.sum(bin1 & bin2)
-    total = np.sum(bin1) + np.sum(bin2)
+    # Threshold only the mask voxels and pack 8 per byte; the overlap is then
+    # popcounts over a few KB instead of sums over full-volume bool arrays
+    bits1 = np.packbits(map1[mask] > threshold)
+    bits2 = np.packbits(map2[mask] > threshold)
+    intersection = int(_POPCOUNT8[bits1 & bits2].sum())
+    total = int(_POPCOUNT8[bits1].sum()) + int(_POPCOUNT8[bits2].sum())
     return 2 * intersection / total if total > 0 else 0
 
 
+# ============================================================================
+# Output
+# ============================================================================
+
+# zlib releases the GIL, so map compression overlaps the next searchlight
+_GZIP_POOL = ThreadPoolExecutor(max_workers=2)
+_GZIP_JOBS = []  # (out_nii, future) for every map handed to _GZIP_POOL
+
+
+def _gzip_and_replace(nii_path):
+    tmp = nii_path.with_name(nii_path.name + '.gz.part')
+    with open(nii_path, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, nii_path.with_name(nii_path.name + '.gz'))
+    nii_path.unlink()
+
+
+def save_map(data, affine, out_nii):
+    """Save a float32 map as .nii now and gzip it to out_nii (.nii.gz) in the background.
+    
+    The gzip is tracked in _GZIP_JOBS; finish_saved_maps waits for it.
+    """
+    raw = out_nii.with_suffix('')
+    nib.save(nib.Nifti1Image(data.astype(np.float32, copy=False), affine), raw)
+    future = _GZIP_POOL.submit(_gzip_and_replace, raw)
+    _GZIP_JOBS.append((out_nii, future))
+    return future
+
+
+def finish_saved_maps():
+    """Wait for every background gzip and report it; True if all succeeded."""
+    ok = True
+    for out_nii, future in _GZIP_JOBS:
+        try:
+            future.result()
+            print(f"  Saved: {out_nii.name}")
+        except Exception as e:
+            print(f"  ERROR: could not write {out_nii.name}: {e}")
+            ok = False
+    _GZIP_JOBS.clear()
+    _GZIP_POOL.shutdown(wait=True)
+    return ok
+
+
 # ============================================================================
 # Main Analysis
 # ============================================================================
@@ -309,9 +694,11 @@ def analyze_pairwise_session(sub, ses, cat1, cat2, hemi, save_maps=True):
         print(f"  ERROR: No mask found")
         return None
     print(f"  Mask voxels: {np.sum(mask_data)}")
+    sphere_index = load_sphere_index(sub, ses, hemi, comp_name, mask_data)
     
     # Extract patterns
-    X, y, runs = extract_pairwise_patterns(sub, ses, cat1, cat2, hemi, use_registered=is_comparison)
+    X, y, runs = extract_pairwise_patterns(sub, ses, cat1, cat2, hemi, mask_data,
+                                           use_registered=is_comparison)
     if X is None:
         print(f"  ERROR: No patterns extracted")
         return None
@@ -320,9 +707,7 @@ def analyze_pairwise_session(sub, ses, cat1, cat2, hemi, save_maps=True):
     
     # Run searchlight
     print(f"  Running searchlight (radius={SL_RADIUS}mm)...")
-    acc_map = run_searchlight(X, y, runs, mask_data)
-    if acc_map is None:
-        return None
+    acc_map = run_searchlight(X, y, runs, mask_data, sphere_index)
     
     # Stats
     stats = compute_region_stats(acc_map, mask_data)
@@ -343,14 +728,14 @@ def analyze_pairwise_session(sub, ses, cat1, cat2, hemi, save_maps=True):
         out_dir.mkdir(parents=True, exist_ok=True)
         
         out_nii = out_dir / f'{sub}_ses-{ses}_{hemi}_{comp_name.lower()}_accuracy.nii.gz'
-        nib.save(nib.Nifti1Image(acc_map, affine), out_nii)
-        print(f"  Saved: {out_nii.name}")
+        save_map(acc_map, affine, out_nii)
         
         out_json = out_dir / f'{sub}_ses-{ses}_{hemi}_{comp_name.lower()}_stats.json'
         with open(out_json, 'w') as f:
             json.dump(stats, f, indent=2)
     
-    return {'accuracy_map': acc_map, 'stats': stats, 'mask': mask_data, 'affine': affine}
+    return {'accuracy_map': acc_map, 'stats': stats, 'mask': mask_data, 'affine': affine,
+            'sphere_index': sphere_index, 'X': X, 'y': y, 'runs': runs}
 
 
 def analyze_pairwise_cross_sessions(sub, cat1, cat2, hemi, results_anchor, results_comp):
@@ -376,19 +761,20 @@ def analyze_pairwise_cross_sessions(sub, cat1, cat2, hemi, results_anchor, resul
     print(f"  Accuracy change: {acc_change:+.3f}")
     
     # Cross-temporal
+    # Same mask and registration as the per-session passes, so reuse their patterns
     print(f"  Running cross-temporal searchlight...")
-    X1, y1, _ = extract_pairwise_patterns(sub, anchor_ses, cat1, cat2, hemi, use_registered=False)
-    X2, y2, _ = extract_pairwise_patterns(sub, comp_ses, cat1, cat2, hemi, use_registered=True)
+    X1, y1 = results_anchor['X'], results_anchor['y']
+    X2, y2 = results_comp['X'], results_comp['y']
     
     ct_mean = None
     if X1 is not None and X2 is not None:
-        ct_map = run_cross_temporal_searchlight(X1, y1, X2, y2, mask_data)
-        if ct_map is not None:
-            ct_mean = float(np.nanmean(ct_map[mask_data]))
-            print(f"  Cross-temporal accuracy: {ct_mean:.3f}")
-            
-            out_nii = out_dir / f'{sub}_{hemi}_{comp_name.lower()}_cross_temporal.nii.gz'
-            nib.save(nib.Nifti1Image(ct_map, affine), out_nii)
+        ct_map = run_cross_temporal_searchlight(X1, y1, X2, y2, mask_data,
+                                                results_anchor['sphere_index'])
+        ct_mean = float(np.nanmean(ct_map[mask_data], dtype=np.float32))
+        print(f"  Cross-temporal accuracy: {ct_mean:.3f}")
+        
+        out_nii = out_dir / f'{sub}_{hemi}_{comp_name.lower()}_cross_temporal.nii.gz'
+        save_map(ct_map, affine, out_nii)
     else:
         print(f"  ERROR: Could not run cross-temporal")
     
@@ -411,6 +797,32 @@ def analyze_pairwise_cross_sessions(sub, cat1, cat2, hemi, results_anchor, resul
     return summary
 
 
+def load_pairwise_session(sub, ses, cat1, cat2, hemi):
+    """Rebuild an analyze_pairwise_session result from its saved map and stats."""
+    anchor_ses, comp_ses = get_sessions(sub)
+    comp_name = f"{cat1}_vs_{cat2}"
+    out_dir = OUTPUT_DIR / sub
+    acc_file = out_dir / f'{sub}_ses-{ses}_{hemi}_{comp_name.lower()}_accuracy.nii.gz'
+    stats_file = out_dir / f'{sub}_ses-{ses}_{hemi}_{comp_name.lower()}_stats.json'
+    if not (acc_file.exists() and stats_file.exists()):
+        return None
+    
+    mask_data, affine = load_mask(sub, ses, hemi, [cat1, cat2])
+    if mask_data is None:
+        return None
+    # Patterns come from the compressed run cache written by the array task
+    X, y, runs = extract_pairwise_patterns(sub, ses, cat1, cat2, hemi, mask_data,
+                                           use_registered=(ses == comp_ses))
+    if X is None:
+        return None
+    with open(stats_file) as f:
+        stats = json.load(f)
+    return {'accuracy_map': np.asanyarray(nib.load(acc_file).dataobj), 'stats': stats,
+            'mask': mask_data, 'affine': affine,
+            'sphere_index': load_sphere_index(sub, ses, hemi, comp_name, mask_data),
+            'X': X, 'y': y, 'runs': runs}
+
+
 # ============================================================================
 # Main
 # ============================================================================
@@ -423,6 +835,11 @@ def main():
     parser.add_argument('--hemi', type=str, choices=['l', 'r'])
     parser.add_argument('--all-comps', action='store_true', help='Run all comparisons')
     parser.add_argument('--cross-session', action='store_true')
+    parser.add_argument('--task-id', type=int, help='Run only jobs[task_id::n_tasks] '
+                        '(e.g. $SLURM_ARRAY_TASK_ID)')
+    parser.add_argument('--n-tasks', type=int, default=1)
+    parser.add_argument('--collect', action='store_true',
+                        help='Run the cross-session step on maps saved by array tasks')
     args = parser.parse_args()
     
     sub_info = get_subject_info_from_csv(args.sub)
@@ -450,26 +867,37 @@ def main():
     
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
-    all_results = {}
+    # Every (comparison, session) searchlight is independent; an array task
+    # runs its share and leaves the cross-session step to --collect
+    jobs = list(itertools.product(comparisons_to_run, sessions_to_run))
+    if args.task_id is not None:
+        jobs = jobs[args.task_id::args.n_tasks]
+        print(f"-> Task {args.task_id}/{args.n_tasks}: {len(jobs)} job(s)")
     
-    for cat1, cat2 in comparisons_to_run:
-        comp_key = f"{cat1}_vs_{cat2}"
-        all_results[comp_key] = {}
-        
-        for ses in sessions_to_run:
+    all_results = {f"{cat1}_vs_{cat2}": {} for cat1, cat2 in comparisons_to_run}
+    
+    for (cat1, cat2), ses in jobs:
+        if args.collect:
+            result = load_pairwise_session(args.sub, ses, cat1, cat2, args.hemi)
+        else:
             result = analyze_pairwise_session(args.sub, ses, cat1, cat2, args.hemi)
-            if result:
-                all_results[comp_key][ses] = result
-        
-        # Cross-session
-        if args.cross_session or (args.ses is None):
-            if anchor_ses in all_results[comp_key] and comp_ses in all_results[comp_key]:
-                analyze_pairwise_cross_sessions(
-                    args.sub, cat1, cat2, args.hemi,
-                    all_results[comp_key][anchor_ses],
-                    all_results[comp_key][comp_ses]
-                )
+        if result:
+            all_results[f"{cat1}_vs_{cat2}"][ses] = result
     
+    # Cross-session
+    run_cross = args.collect or (args.task_id is None and
+                                 (args.cross_session or args.ses is None))
+    for cat1, cat2 in comparisons_to_run:
+        comp_key = f"{cat1}_vs_{cat2}"
+        if run_cross and anchor_ses in all_results[comp_key] and comp_ses in all_results[comp_key]:
+            analyze_pairwise_cross_sessions(
+                args.sub, cat1, cat2, args.hemi,
+                all_results[comp_key][anchor_ses],
+                all_results[comp_key][comp_ses]
+            )
+    
+    if not finish_saved_maps():
+        sys.exit(1)
     print("\n=== COMPLETE ===")
 
 
@@ -29,6 +29,12 @@ import numpy as np
 import pandas as pd
 import os
 import sys
+import functools
+import hashlib
+import shutil
+import tempfile
+import atexit
+from collections import defaultdict
 from pathlib import Path
 import nibabel as nib
 from nilearn import image
@@ -37,11 +43,11 @@ from nilearn.image import load_img, get_data, resample_to_img, new_img_like
 from sklearn.svm import SVC
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import make_pipeline
-from sklearn.model_selection import StratifiedShuffleSplit, LeaveOneGroupOut, cross_val_score
+from sklearn.model_selection import StratifiedShuffleSplit, LeaveOneGroupOut
 from scipy import ndimage
 from scipy.stats import ttest_rel, ttest_ind
-import pickle
 import gc
+import joblib
 
 # Try to import brainiak (may not be available in all environments)
 try:
@@ -52,6 +58,13 @@ except ImportError:
     print("WARNING: BrainIAK not available. Using nilearn searchlight instead.")
     from nilearn.decoding import SearchLight
 
+# Numba is optional; block extraction falls back to NumPy without it
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -100,6 +113,10 @@ class Config:
     TR = 2.0  # seconds
     BLOCK_DURATION = 12  # seconds (adjust based on your design)
     HRF_DELAY = 4  # seconds (peak HRF delay)
+    
+    # Data loading
+    FUNC_READ_VOLS = 32  # volumes decoded per read when masking a run
+    SCRATCH_DIR = None  # where per-subject run pools go (None: system temp dir)
 
 
 # =============================================================================
@@ -133,20 +150,22 @@ def find_available_runs(subject, session, base_dir=None):
     base_dir = base_dir or Config.BASE_DIR
     feat_dir = base_dir / subject / f'ses-{session:02d}' / 'derivatives' / 'fsl' / 'loc'
     
-    runs = []
-    for run in range(1, 10):  # Check up to 9 runs
-        run_dir = feat_dir / f'run-{run:02d}.feat'
-        func_file = run_dir / 'filtered_func_data_reg.nii.gz'
-        if func_file.exists():
-            runs.append(run)
+    # One directory scan instead of a stat per candidate run (runs 1-9)
+    matches = feat_dir.glob('run-0[1-9].feat/filtered_func_data_reg.nii.gz')
+    runs = sorted(int(p.parent.name[4:6]) for p in matches)
     return runs
 
 
+def functional_data_path(subject, session, run, base_dir=None):
+    """Path to the preprocessed functional data for a run"""
+    base_dir = base_dir or Config.BASE_DIR
+    return (base_dir / subject / f'ses-{session:02d}' / 'derivatives' / 
+            'fsl' / 'loc' / f'run-{run:02d}.feat' / 'filtered_func_data_reg.nii.gz')
+
+
 def load_functional_data(subject, session, run, base_dir=None):
     """Load preprocessed functional data for a run"""
-    base_dir = base_dir or Config.BASE_DIR
-    func_path = (base_dir / subject / f'ses-{session:02d}' / 'derivatives' / 
-                 'fsl' / 'loc' / f'run-{run:02d}.feat' / 'filtered_func_data_reg.nii.gz')
+    func_path = functional_data_path(subject, session, run, base_dir)
     
     if not func_path.exists():
         raise FileNotFoundError(f"Functional data not found: {func_path}")
@@ -154,6 +173,127 @@ def load_functional_data(subject, session, run, base_dir=None):
     return load_img(str(func_path))
 
 
+# Scratch directory of the current subject's memory-mapped masked runs
+_RUN_POOL = {}
+
+
+def open_run_pool(subject):
+    """Start a scratch pool for the subject's masked runs
+    
+    While a pool is open, load_masked_data writes each decoded run to a
+    float32 .npy in the pool and serves it memory-mapped, so runs live in
+    the page cache rather than process memory and are never decoded twice.
+    """
+    close_run_pool()
+    _RUN_POOL['dir'] = Path(tempfile.mkdtemp(prefix=f'{subject}_runs_',
+                                             dir=Config.SCRATCH_DIR))
+
+
+def close_run_pool():
+    """Drop cached runs and delete the scratch pool, if one is open"""
+    clear_data_cache()
+    pool_dir = _RUN_POOL.pop('dir', None)
+    if pool_dir is not None:
+        shutil.rmtree(pool_dir, ignore_errors=True)
+
+
+atexit.register(close_run_pool)
+
+
+def _run_pool_file(func_path, mask_key):
+    """Pool file for a (run, mask), or None when no pool is open"""
+    pool_dir = _RUN_POOL.get('dir')
+    if pool_dir is None:
+        return None
+    digest = hashlib.sha1(func_path.encode())
+    if mask_key is not None:
+        digest.update(mask_key[0])
+    return pool_dir / f'{digest.hexdigest()}.npy'
+
+
+@functools.lru_cache(maxsize=32)
+def _load_masked_cached(func_path, mask_key):
+    """Decode a run once per (path, mask); see load_masked_data"""
+    pool_file = _run_pool_file(func_path, mask_key)
+    if pool_file is not None and pool_file.exists():
+        return np.load(pool_file, mmap_mode='r')
+    
+    # Keep the file open so successive volume chunks continue the gzip
+    # stream instead of decompressing from the start each time
+    img = nib.load(func_path, keep_file_open=True)
+    vol_shape, n_volumes = img.shape[:3], img.shape[-1]
+    mask = None
+    if mask_key is not None:
+        packed, n_voxels = mask_key
+        mask = np.unpackbits(np.frombuffer(packed, dtype=np.uint8),
+                             count=n_voxels).astype(bool).reshape(vol_shape)
+    
+    # Stream a few volumes at a time straight into the compressed array, so
+    # the full 4D run is never resident
+    n_cols = np.count_nonzero(mask) if mask is not None else np.prod(vol_shape)
+    if pool_file is not None:
+        data = np.lib.format.open_memmap(pool_file, mode='w+', dtype=np.float32,
+                                         shape=(int(n_volumes), int(n_cols)))
+    else:
+        data = np.empty((n_volumes, n_cols), dtype=np.float32)
+    for lo in range(0, n_volumes, Config.FUNC_READ_VOLS):
+        hi = min(lo + Config.FUNC_READ_VOLS, n_volumes)
+        chunk = np.asarray(img.dataobj[..., lo:hi], dtype=np.float32)
+        data[lo:hi] = (chunk[mask] if mask is not None else chunk.reshape(-1, hi - lo)).T
+    
+    if pool_file is not None:
+        data.flush()
+        del data
+        return np.load(pool_file, mmap_mode='r')
+    data.flags.writeable = False  # shared between callers
+    return data
+
+
+def load_masked_data(subject, session, run, mask_flat=None, base_dir=None):
+    """Load a run as a mask-compressed (n_volumes, n_voxels) float32 array
+    
+    Voxels are in C order of the flattened volume (same as mask.ravel()),
+    so each volume is one contiguous row. Results are cached per
+    (run, mask) since every category re-reads the same runs; the
+    returned array is read-only. See clear_data_cache.
+    """
+    func_path = functional_data_path(subject, session, run, base_dir)
+    if not func_path.exists():
+        raise FileNotFoundError(f"Functional data not found: {func_path}")
+    
+    mask_key = None
+    if mask_flat is not None:
+        mask_key = (np.packbits(mask_flat).tobytes(), mask_flat.size)
+    return _load_masked_cached(str(func_path), mask_key)
+
+
+@functools.lru_cache(maxsize=64)
+def _list_dir(dir_path):
+    """File names in a directory, listed once (empty if it does not exist)"""
+    try:
+        return frozenset(os.listdir(dir_path))
+    except FileNotFoundError:
+        return frozenset()
+
+
+@functools.lru_cache(maxsize=256)
+def _load_timing_cached(timing_path):
+    """Parse a timing file once; returns read-only (onset, duration) rows"""
+    timing = np.loadtxt(timing_path)
+    if timing.ndim == 1:
+        timing = timing.reshape(1, -1)
+    timing = timing[:, :2]  # Return onset and duration columns
+    timing.flags.writeable = False
+    return timing
+
+
+def clear_data_cache():
+    """Drop cached functional runs and timing files (call between subjects)"""
+    _load_masked_cached.cache_clear()
+    _list_dir.cache_clear()
+    _load_timing_cached.cache_clear()
+
+
 def load_timing_file(subject, session, run, category, covs_dir=None):
     """Load block timing file for a category
     
@@ -171,13 +311,10 @@ def load_timing_file(subject, session, run, category, covs_dir=None):
         f'run-{run:02d}_{category}.txt'
     ]
     
+    available = _list_dir(str(covs_dir))
     for name in possible_names:
-        timing_path = covs_dir / name
-        if timing_path.exists():
-            timing = np.loadtxt(str(timing_path))
-            if timing.ndim == 1:
-                timing = timing.reshape(1, -1)
-            return timing[:, :2]  # Return onset and duration columns
+        if name in available:
+            return _load_timing_cached(str(covs_dir / name))
     
     raise FileNotFoundError(f"Timing file not found for {subject} ses-{session} run-{run} {category}")
 
@@ -216,13 +353,68 @@ def load_mask(subject, session, hemisphere=None, base_dir=None):
 # BLOCK EXTRACTION
 # =============================================================================
 
-def extract_block_patterns(func_img, timing, tr=None, hrf_delay=None):
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _extract_block_patterns_kernel(data2d, starts, ends, out):
+        """Fill out[b] with the mean of rows starts[b]:ends[b], parallel over blocks"""
+        n_voxels = data2d.shape[1]
+        for b in prange(starts.shape[0]):
+            for v in range(n_voxels):
+                out[b, v] = 0.0
+            for t in range(starts[b], ends[b]):
+                for v in range(n_voxels):
+                    out[b, v] += data2d[t, v]
+            scale = 1.0 / (ends[b] - starts[b])
+            for v in range(n_voxels):
+                out[b, v] *= scale
+
+
+def block_bounds(timing, n_volumes, tr=None, hrf_delay=None):
+    """HRF-shifted [start, end) volume bounds of each non-empty block
+    
+    Returns
+    -------
+    starts, ends : arrays (n_blocks,)
+        Volume indices, clipped to the run; blocks with no volumes are dropped
+    """
+    tr = tr or Config.TR
+    hrf_delay = hrf_delay or Config.HRF_DELAY
+    
+    timing = np.atleast_2d(timing)
+    start_times = timing[:, 0] + hrf_delay
+    end_times = timing[:, 0] + timing[:, 1] + hrf_delay
+    starts = np.floor(start_times / tr).astype(np.int64).clip(0, n_volumes)
+    ends = np.ceil(end_times / tr).astype(np.int64).clip(0, n_volumes)
+    valid = starts < ends
+    return starts[valid], ends[valid]
+
+
+def fill_block_patterns(data2d, starts, ends, out):
+    """Write the mean of data2d[starts[b]:ends[b]] into out[b] for each block"""
+    n_volumes = data2d.shape[0]
+    if NUMBA_AVAILABLE:
+        _extract_block_patterns_kernel(data2d, starts, ends, out)
+    elif len(starts) and np.all(ends[:-1] <= starts[1:]):
+        # Ordered, non-overlapping blocks: one reduceat pass over the time
+        # axis on interleaved [start, end) bounds, keeping the block segments
+        bounds = np.column_stack([starts, ends]).ravel()
+        if bounds[-1] == n_volumes:
+            bounds = bounds[:-1]  # last segment runs to the end anyway
+        sums = np.add.reduceat(data2d, bounds, axis=0)[::2]
+        np.divide(sums, (ends - starts)[:, None], out=out)
+    else:
+        for b, (start_vol, end_vol) in enumerate(zip(starts, ends)):
+            out[b] = data2d[start_vol:end_vol].mean(axis=0)
+    return out
+
+
+def extract_block_patterns(data2d, timing, tr=None, hrf_delay=None):
     """Extract mean activation pattern for each block
     
     Parameters
     ----------
-    func_img : nibabel image
-        4D functional data
+    data2d : array (n_volumes, n_voxels)
+        Mask-compressed functional data (see load_masked_data)
     timing : array-like
         Block timing information (onset, duration)
     tr : float
@@ -235,42 +427,19 @@ def extract_block_patterns(func_img, timing, tr=None, hrf_delay=None):
     patterns : array
         (n_blocks, n_voxels) array of block-averaged patterns
     """
-    tr = tr or Config.TR
-    hrf_delay = hrf_delay or Config.HRF_DELAY
-    
-    data = get_data(func_img)
-    n_volumes = data.shape[-1]
-    
-    patterns = []
-    for onset, duration in timing:
-        # Account for HRF delay
-        start_time = onset + hrf_delay
-        end_time = onset + duration + hrf_delay
-        
-        # Convert to volumes
-        start_vol = int(np.floor(start_time / tr))
-        end_vol = int(np.ceil(end_time / tr))
-        
-        # Bounds checking
-        start_vol = max(0, start_vol)
-        end_vol = min(n_volumes, end_vol)
-        
-        if start_vol < end_vol:
-            # Extract and average volumes for this block
-            block_data = data[..., start_vol:end_vol]
-            block_mean = np.mean(block_data, axis=-1)
-            patterns.append(block_mean)
-    
-    return np.array(patterns)
+    starts, ends = block_bounds(timing, data2d.shape[0], tr, hrf_delay)
+    patterns = np.empty((len(starts), data2d.shape[1]), dtype=np.float32)
+    return fill_block_patterns(data2d, starts, ends, patterns)
 
 
-def prepare_classification_data(subject, session, categories, base_dir=None):
+def prepare_classification_data(subject, session, categories, base_dir=None, mask_data=None):
     """Prepare data for classification
     
     Returns
     -------
     X : array (n_samples, n_voxels)
-        Block patterns for all categories
+        Block patterns for all categories, over the voxels of mask_data
+        (all voxels if no mask is given)
     y : array (n_samples,)
         Category labels
     groups : array (n_samples,)
@@ -282,33 +451,39 @@ def prepare_classification_data(subject, session, categories, base_dir=None):
     if len(runs) == 0:
         raise ValueError(f"No runs found for {subject} ses-{session}")
     
-    all_patterns = []
-    all_labels = []
-    all_groups = []
+    mask_flat = mask_data.ravel() > 0 if mask_data is not None else None
     
+    # First pass: block bounds for every run/category, to size X up front
+    block_sets = []  # (run, cat_idx, starts, ends)
+    n_voxels = 0
     for run in runs:
-        func_img = load_functional_data(subject, session, run, base_dir)
+        data2d = load_masked_data(subject, session, run, mask_flat, base_dir)
+        n_voxels = data2d.shape[1]
         
         for cat_idx, category in enumerate(categories):
             try:
                 timing = load_timing_file(subject, session, run, category)
-                patterns = extract_block_patterns(func_img, timing)
-                
-                n_blocks = len(patterns)
-                all_patterns.append(patterns)
-                all_labels.extend([cat_idx] * n_blocks)
-                all_groups.extend([run] * n_blocks)
-                
             except FileNotFoundError as e:
                 print(f"  Warning: {e}")
                 continue
+            starts, ends = block_bounds(timing, data2d.shape[0])
+            block_sets.append((run, cat_idx, starts, ends))
     
-    if len(all_patterns) == 0:
+    if len(block_sets) == 0:
         raise ValueError(f"No valid data found for {subject} ses-{session}")
     
-    X = np.vstack(all_patterns)
-    y = np.array(all_labels)
-    groups = np.array(all_groups)
+    counts = np.array([len(starts) for _, _, starts, _ in block_sets])
+    y = np.repeat([cat_idx for _, cat_idx, _, _ in block_sets], counts)
+    groups = np.repeat([run for run, _, _, _ in block_sets], counts)
+    
+    # Second pass: write block means straight into their rows of X
+    # (runs come from the load cache)
+    X = np.empty((counts.sum(), n_voxels), dtype=np.float32)
+    row = 0
+    for (run, _, starts, ends), n_blocks in zip(block_sets, counts):
+        data2d = load_masked_data(subject, session, run, mask_flat, base_dir)
+        fill_block_patterns(data2d, starts, ends, X[row:row + n_blocks])
+        row += n_blocks
     
     return X, y, groups
 
@@ -317,21 +492,83 @@ def prepare_classification_data(subject, session, categories, base_dir=None):
 # SEARCHLIGHT CLASSIFICATION
 # =============================================================================
 
+@functools.lru_cache(maxsize=None)
+def ball_offsets(radius_voxels):
+    """(n_offsets, 3) voxel offsets of a ball; shared by every sphere of that radius"""
+    r = radius_voxels
+    dx, dy, dz = np.mgrid[-r:r + 1, -r:r + 1, -r:r + 1]
+    inside = dx * dx + dy * dy + dz * dz <= r * r
+    offsets = np.stack([dx[inside], dy[inside], dz[inside]], axis=1)
+    offsets.flags.writeable = False
+    return offsets
+
+
 def create_searchlight_sphere_indices(shape, center, radius_voxels):
-    """Create indices for a sphere centered at a voxel"""
-    indices = []
-    for x in range(-radius_voxels, radius_voxels + 1):
-        for y in range(-radius_voxels, radius_voxels + 1):
-            for z in range(-radius_voxels, radius_voxels + 1):
-                if x**2 + y**2 + z**2 <= radius_voxels**2:
-                    new_x = center[0] + x
-                    new_y = center[1] + y
-                    new_z = center[2] + z
-                    if (0 <= new_x < shape[0] and 
-                        0 <= new_y < shape[1] and 
-                        0 <= new_z < shape[2]):
-                        indices.append((new_x, new_y, new_z))
-    return indices
+    """Create indices for a sphere centered at a voxel
+    
+    Returns
+    -------
+    indices : array (n_voxels, 3)
+        In-bounds voxel coordinates of the sphere
+    """
+    coords = ball_offsets(radius_voxels) + np.asarray(center)
+    in_bounds = np.all((coords >= 0) & (coords < np.asarray(shape[:3])), axis=1)
+    return coords[in_bounds]
+
+
+def standardize_with_train(X, train_idx, out=None):
+    """Z-score all rows of X using the mean/std of the training rows
+    
+    Same result as fitting StandardScaler on X[train_idx] and transforming
+    X (zero-variance columns are left unscaled), without the estimator and
+    validation overhead. Pass ``out`` to reuse a buffer across folds.
+    """
+    X_train = X[train_idx]
+    mu = X_train.mean(axis=0)
+    sd = X_train.std(axis=0)
+    sd[sd == 0] = 1.0
+    out = np.subtract(X, mu, out=out)
+    out /= sd
+    return out
+
+
+def _precomputed_fold_score(X, y, train_idx, test_idx, C=1):
+    """Score one fold of StandardScaler + linear SVC through its Gram matrix
+    
+    X may be float32; each fold standardizes a float64 copy, so the
+    voxel-wide kernel products are accumulated in double precision.
+    """
+    X_scaled = np.array(X, dtype=np.float64)
+    standardize_with_train(X_scaled, train_idx, out=X_scaled)
+    X_train = X_scaled[train_idx]
+    # One product gives the train and test rows of the kernel
+    rows = np.concatenate([train_idx, test_idx])
+    K = X_scaled[rows] @ X_train.T
+    n_train = len(train_idx)
+    clf = SVC(kernel='precomputed', C=C)
+    clf.fit(K[:n_train], y[train_idx])
+    return clf.score(K[n_train:], y[test_idx])
+
+
+def linear_svm_cv_scores(X, y, cv, n_jobs=-1):
+    """Cross-validated accuracy of a standardized linear SVM
+    
+    Equivalent to cross_val_score(make_pipeline(StandardScaler(),
+    SVC(kernel='linear', C=1)), X, y, cv=cv), but each fold trains on an
+    (n_train, n_train) linear kernel instead of the voxel-wide patterns,
+    and folds run in parallel threads (BLAS and libsvm release the GIL).
+    
+    Returns
+    -------
+    scores : array (n_splits,)
+        Test accuracy per fold
+    """
+    X = np.asarray(X, dtype=np.float32)
+    scores = joblib.Parallel(n_jobs=n_jobs, prefer='threads', pre_dispatch='2*n_jobs')(
+        joblib.delayed(_precomputed_fold_score)(X, y, train_idx, test_idx)
+        for train_idx, test_idx in cv.split(X, y)
+    )
+    return np.array(scores)
 
 
 def searchlight_svm(X, y, groups=None, mask_img=None, radius=None, 
@@ -381,8 +618,12 @@ def searchlight_svm(X, y, groups=None, mask_img=None, radius=None,
         verbose=0
     )
     
-    # Fit searchlight
-    sl.fit(X, y)
+    # Fit searchlight. Threads share X in memory instead of pickling it to
+    # every loky worker; libsvm releases the GIL while fitting.
+    if isinstance(X, np.ndarray):
+        X = X.astype(np.float32, copy=False)
+    with joblib.parallel_backend('threading', n_jobs=n_jobs):
+        sl.fit(X, y)
     
     return sl.scores_img_
 
@@ -400,12 +641,13 @@ def run_searchlight_decoding_brainiak(X, y, mask, radius_voxels=None,
     n_folds = n_folds or Config.N_FOLDS
     test_size = test_size or Config.TEST_SIZE
     
-    # Set up cross-validation
+    # Set up cross-validation once and broadcast the folds to every sphere
     cv = StratifiedShuffleSplit(n_splits=n_folds, test_size=test_size, random_state=42)
+    splits = list(cv.split(X, y))
     
     def classify_sphere(data, sl_mask, myrad, bcvar):
         """Classification function for each searchlight sphere"""
-        X_data, y_labels, cv_obj = bcvar
+        y_labels, cv_splits = bcvar
         
         # Get data for this sphere
         data4D = data[0]
@@ -415,25 +657,21 @@ def run_searchlight_decoding_brainiak(X, y, mask, radius_voxels=None,
         sphere_data = data4D.reshape(-1, n_samples).T
         
         # Remove zero-variance voxels
-        valid_mask = np.std(sphere_data, axis=0) > 0
-        if np.sum(valid_mask) < 3:
+        valid_mask = np.ptp(sphere_data, axis=0) > 0  # constant voxels (min == max)
+        if np.count_nonzero(valid_mask) < 3:
             return 0.5  # Chance level
         
         sphere_data = sphere_data[:, valid_mask]
         
-        # Run classification
-        clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
-        scores = []
-        
-        for train_idx, test_idx in cv_obj.split(X_data, y_labels):
-            clf.fit(sphere_data[train_idx], y_labels[train_idx])
-            scores.append(clf.score(sphere_data[test_idx], y_labels[test_idx]))
+        # Train-fold standardization, then linear SVM on the Gram matrix
+        scores = [_precomputed_fold_score(sphere_data, y_labels, train_idx, test_idx)
+                  for train_idx, test_idx in cv_splits]
         
         return np.mean(scores)
     
     # Reshape X to (x, y, z, samples)
     shape = mask.shape + (X.shape[0],)
-    data_4d = np.zeros(shape)
+    data_4d = np.zeros(shape, dtype=np.float32)
     
     # This is a simplified version - in practice, you'd need to properly
     # map the flattened X back to 3D space
@@ -441,7 +679,7 @@ def run_searchlight_decoding_brainiak(X, y, mask, radius_voxels=None,
     # Set up searchlight
     sl = Searchlight(sl_rad=radius_voxels, max_blk_edge=5, shape=Ball)
     sl.distribute([data_4d], mask)
-    sl.broadcast((X, y, cv))
+    sl.broadcast((y, splits))
     
     result = sl.run_searchlight(classify_sphere, pool_size=1)
     
@@ -461,12 +699,12 @@ def compute_dice_coefficient(map1, map2, threshold=0.5):
     binary1 = map1 > threshold
     binary2 = map2 > threshold
     
-    intersection = np.logical_and(binary1, binary2)
-    
-    if np.sum(binary1) + np.sum(binary2) == 0:
+    total = np.count_nonzero(binary1) + np.count_nonzero(binary2)
+    if total == 0:
         return 0.0
     
-    dice = 2 * np.sum(intersection) / (np.sum(binary1) + np.sum(binary2))
+    binary1 &= binary2
+    dice = 2 * np.count_nonzero(binary1) / total
     return dice
 
 
@@ -479,23 +717,23 @@ def analyze_accuracy_maps(acc_map_ses1, acc_map_ses2, mask_data, category):
     - mean_accuracy_ses2: Mean accuracy in session 2
     - accuracy_change: Change in mean accuracy
     """
-    # Apply mask
-    masked_acc1 = acc_map_ses1[mask_data > 0]
-    masked_acc2 = acc_map_ses2[mask_data > 0]
+    # Apply mask once; Dice only needs the in-mask voxels (voxels outside
+    # the mask were zeroed before, which never pass a positive threshold)
+    in_mask = mask_data > 0
+    masked_acc1 = acc_map_ses1[in_mask]
+    masked_acc2 = acc_map_ses2[in_mask]
+    mean_acc1 = np.mean(masked_acc1)
+    mean_acc2 = np.mean(masked_acc2)
     
     results = {
         'category': category,
-        'dice_0.55': compute_dice_coefficient(acc_map_ses1 * (mask_data > 0), 
-                                               acc_map_ses2 * (mask_data > 0), 
-                                               threshold=0.55),
-        'dice_0.60': compute_dice_coefficient(acc_map_ses1 * (mask_data > 0), 
-                                               acc_map_ses2 * (mask_data > 0), 
-                                               threshold=0.60),
-        'mean_acc_ses1': np.mean(masked_acc1),
-        'mean_acc_ses2': np.mean(masked_acc2),
+        'dice_0.55': compute_dice_coefficient(masked_acc1, masked_acc2, threshold=0.55),
+        'dice_0.60': compute_dice_coefficient(masked_acc1, masked_acc2, threshold=0.60),
+        'mean_acc_ses1': mean_acc1,
+        'mean_acc_ses2': mean_acc2,
         'max_acc_ses1': np.max(masked_acc1),
         'max_acc_ses2': np.max(masked_acc2),
-        'accuracy_change': np.mean(masked_acc2) - np.mean(masked_acc1),
+        'accuracy_change': mean_acc2 - mean_acc1,
     }
     
     # Categorize as bilateral or unilateral
@@ -505,33 +743,29 @@ def analyze_accuracy_maps(acc_map_ses1, acc_map_ses2, mask_data, category):
     return results
 
 
-def cross_temporal_decoding(X_ses1, y_ses1, X_ses2, y_ses2, mask_data):
+def cross_temporal_decoding(X_ses1, y_ses1, X_ses2, y_ses2):
     """Train on session 1, test on session 2 (and vice versa)
     
     Tests whether representational code is stable across sessions.
+    X_ses1 and X_ses2 are (n_samples, n_voxels) patterns over the same mask.
     
     Returns
     -------
     dict with forward and backward cross-temporal accuracy
     """
-    clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
-    
-    # Flatten spatial dimensions
-    X1_flat = X_ses1.reshape(X_ses1.shape[0], -1)
-    X2_flat = X_ses2.reshape(X_ses2.shape[0], -1)
-    
-    # Apply mask
-    mask_flat = mask_data.flatten() > 0
-    X1_masked = X1_flat[:, mask_flat]
-    X2_masked = X2_flat[:, mask_flat]
+    # Each direction is a single "fold" over the stacked sessions: scale with
+    # the training session, then one kernel against its rows serves both the
+    # fit (train x train) and the scoring (test x train)
+    X_both = np.vstack([X_ses1, X_ses2]).astype(np.float32, copy=False)
+    y_both = np.concatenate([y_ses1, y_ses2])
+    ses1 = np.arange(len(X_ses1))
+    ses2 = np.arange(len(X_ses1), len(X_both))
     
     # Forward: train ses1 → test ses2
-    clf.fit(X1_masked, y_ses1)
-    forward_acc = clf.score(X2_masked, y_ses2)
+    forward_acc = _precomputed_fold_score(X_both, y_both, ses1, ses2)
     
     # Backward: train ses2 → test ses1
-    clf.fit(X2_masked, y_ses2)
-    backward_acc = clf.score(X1_masked, y_ses1)
+    backward_acc = _precomputed_fold_score(X_both, y_both, ses2, ses1)
     
     return {
         'cross_temporal_forward': forward_acc,
@@ -572,12 +806,16 @@ def run_subject_analysis(subject, base_dir=None, output_dir=None, categories=Non
         'categories': {}
     }
     
+    # Runs are decoded once into a scratch pool shared by all categories
+    open_run_pool(subject)
+    
     # Load mask (from first session)
     try:
         mask_img = load_mask(subject, sessions[0], base_dir=base_dir)
         mask_data = get_data(mask_img)
     except Exception as e:
         print(f"  Error loading mask: {e}")
+        close_run_pool()
         return None
     
     for category in categories:
@@ -595,7 +833,8 @@ def run_subject_analysis(subject, base_dir=None, output_dir=None, categories=Non
                 X, y, groups = prepare_classification_data(
                     subject, session, 
                     categories=[category, 'scramble'],
-                    base_dir=base_dir
+                    base_dir=base_dir,
+                    mask_data=mask_data
                 )
                 
                 # Store for cross-temporal analysis
@@ -609,23 +848,18 @@ def run_subject_analysis(subject, base_dir=None, output_dir=None, categories=Non
                 # to properly handle the spatial structure
                 
                 # For now, compute ROI-based accuracy as a proxy
-                clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
                 cv = StratifiedShuffleSplit(n_splits=Config.N_FOLDS, 
                                             test_size=Config.TEST_SIZE, 
                                             random_state=42)
                 
-                # Flatten spatial dimensions for each sample
-                X_flat = X.reshape(X.shape[0], -1)
-                
-                # Apply mask
-                mask_flat = mask_data.flatten() > 0
-                X_masked = X_flat[:, mask_flat]
+                # X is already restricted to the mask voxels
+                X_masked = X
                 
                 # Remove zero-variance features
-                valid_features = np.std(X_masked, axis=0) > 0
+                valid_features = np.ptp(X_masked, axis=0) > 0
                 X_masked = X_masked[:, valid_features]
                 
-                scores = cross_val_score(clf, X_masked, y, cv=cv)
+                scores = linear_svm_cv_scores(X_masked, y, cv)
                 mean_accuracy = np.mean(scores)
                 
                 category_results['sessions'][session] = {
@@ -648,8 +882,7 @@ def run_subject_analysis(subject, base_dir=None, output_dir=None, categories=Non
                     session_data[sessions[0]]['X'],
                     session_data[sessions[0]]['y'],
                     session_data[sessions[1]]['X'],
-                    session_data[sessions[1]]['y'],
-                    mask_data
+                    session_data[sessions[1]]['y']
                 )
                 category_results['cross_temporal'] = cross_temp
                 print(f"    Cross-temporal accuracy: {cross_temp['cross_temporal_mean']:.3f}")
@@ -672,26 +905,40 @@ def run_subject_analysis(subject, base_dir=None, output_dir=None, categories=Non
         results['categories'][category] = category_results
     
     # Save results
-    output_file = output_dir / f'{subject}_searchlight_results.pkl'
-    with open(output_file, 'wb') as f:
-        pickle.dump(results, f)
+    output_file = output_dir / f'{subject}_searchlight_results.joblib'
+    joblib.dump(results, output_file, compress=3)
     
     print(f"\n  Results saved to {output_file}")
     
+    close_run_pool()
     return results
 
 
-def run_group_analysis(results_list, output_dir=None):
+def load_subject_results(output_dir=None):
+    """Load every saved per-subject result from output_dir"""
+    output_dir = Path(output_dir) if output_dir else Config.OUTPUT_DIR
+    return [joblib.load(path) 
+            for path in sorted(output_dir.glob('*_searchlight_results.joblib'))]
+
+
+def run_group_analysis(results_list=None, output_dir=None):
     """Aggregate results across subjects and compare groups
     
     Compares:
     - OTC vs nonOTC vs Control
     - Bilateral vs Unilateral categories
+    
+    If results_list is None, the per-subject results saved by
+    run_subject_analysis are loaded from output_dir.
     """
     output_dir = Path(output_dir) if output_dir else Config.OUTPUT_DIR
+    if results_list is None:
+        results_list = load_subject_results(output_dir)
     
-    # Compile results into DataFrame
-    rows = []
+    # Compile results into DataFrame, one list per column (columns that a
+    # row lacks, e.g. other session numbers, are padded with NaN)
+    columns = defaultdict(list)
+    n_rows = 0
     
     for result in results_list:
         if result is None:
@@ -726,9 +973,15 @@ def run_group_analysis(results_list, output_dir=None):
             if isinstance(cross_temp, dict):
                 row['cross_temporal_acc'] = cross_temp.get('cross_temporal_mean', np.nan)
             
-            rows.append(row)
-    
-    df = pd.DataFrame(rows)
+            for key, value in row.items():
+                column = columns[key]
+                column.extend([np.nan] * (n_rows - len(column)))
+                column.append(value)
+            n_rows += 1
+    
+    for column in columns.values():
+        column.extend([np.nan] * (n_rows - len(column)))
+    df = pd.DataFrame(columns)
     
     # Save compiled results
     df.to_csv(output_dir / 'group_searchlight_results.csv', index=False)
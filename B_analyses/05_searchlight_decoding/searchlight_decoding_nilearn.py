@@ -26,21 +26,42 @@ Key Analyses:
 Author: PhD Research Project
 """
 
+import os
+import re
+import functools
+import tempfile
 import numpy as np
 import pandas as pd
+import nibabel as nib
 from pathlib import Path
+from collections import defaultdict
 from nilearn import image
-from nilearn.image import load_img, get_data, new_img_like, concat_imgs, index_img
+from nilearn.image import load_img, get_data, new_img_like
 from nilearn.masking import compute_brain_mask, apply_mask, unmask
-from nilearn.decoding import SearchLight
-from sklearn.svm import SVC
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import make_pipeline
+from sklearn.svm import SVC, LinearSVC
+from sklearn.neighbors import NearestNeighbors
 from sklearn.model_selection import (StratifiedShuffleSplit, LeaveOneGroupOut, 
-                                     cross_val_score, StratifiedKFold)
+                                     StratifiedKFold)
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from concurrent.futures import ProcessPoolExecutor
 import warnings
 warnings.filterwarnings("ignore")
 
+# Numba is optional; the block-mean and Dice kernels fall back to NumPy
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Zarr is optional; without it functional data is always read from NIfTI
+try:
+    import zarr
+    ZARR_AVAILABLE = True
+except ImportError:
+    ZARR_AVAILABLE = False
+
 # =============================================================================
 # PATHS AND CONFIGURATION
 # =============================================================================
@@ -84,6 +105,12 @@ TR = 2.0
 BLOCK_DURATION = 12  # seconds
 HRF_DELAY = 4  # seconds
 
+# Volumes per chunk of the time-chunked Zarr copies of the runs (see nifti_to_zarr)
+ZARR_TIME_CHUNK = 16
+
+# Where searchlight inputs are shared with worker processes (RAM-backed if possible)
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
 
 # =============================================================================
 # DATA LOADING FUNCTIONS
@@ -103,28 +130,122 @@ def get_subject_info(subject):
         raise ValueError(f"Unknown subject: {subject}")
 
 
-def find_runs(subject, session, base_dir=BASE_DIR):
-    """Find available functional runs"""
-    loc_dir = base_dir / subject / f'ses-{session:02d}' / 'derivatives' / 'fsl' / 'loc'
+@functools.lru_cache(maxsize=None)
+def _list_dir(dir_path):
+    """Names in a directory, read once with a single scandir (empty if missing)"""
+    try:
+        with os.scandir(dir_path) as entries:
+            return frozenset(entry.name for entry in entries)
+    except OSError:
+        return frozenset()
+
+
+@functools.lru_cache(maxsize=64)
+def _index_session(subject, session, base_dir=BASE_DIR):
+    """Runs and timing files of one session, from a single pass over its listings
+    
+    Returns
+    -------
+    runs : list of int
+        Runs 1-9 whose run-XX.feat holds filtered_func_data_reg.nii.gz
+    timing_files : dict
+        (run, category) -> timing paths, in load_timing's order of preference
+    """
+    ses_dir = base_dir / subject / f'ses-{session:02d}'
+    loc_dir = ses_dir / 'derivatives' / 'fsl' / 'loc'
     
     runs = []
-    for run_num in range(1, 10):
-        func_file = loc_dir / f'run-{run_num:02d}.feat' / 'filtered_func_data_reg.nii.gz'
-        if func_file.exists():
-            runs.append(run_num)
+    for name in sorted(_list_dir(str(loc_dir))):
+        match = re.fullmatch(r'run-0([1-9])\.feat', name)
+        if match and 'filtered_func_data_reg.nii.gz' in _list_dir(str(loc_dir / name)):
+            runs.append(int(match.group(1)))
+    
+    # Same naming patterns as before (catloc_<sub>_run-0<run>_<cat>.txt with
+    # the full or numeric subject ID, <cat>_run<run>.txt, run<run>_<cat>.txt),
+    # ranked by preference
+    sub_num = subject.replace('sub-', '').lstrip('0')
+    run_num = r'(?P<run>[1-9]\d*)'
+    timing_patterns = [
+        re.compile(rf'catloc_{re.escape(subject)}_run-0{run_num}_(?P<cat>.+)\.txt'),
+        re.compile(rf'catloc_{re.escape(sub_num)}_run-0{run_num}_(?P<cat>.+)\.txt'),
+        re.compile(rf'(?P<cat>.+)_run{run_num}\.txt'),
+        re.compile(rf'run{run_num}_(?P<cat>.+)\.txt'),
+    ]
     
-    return runs
+    covs_dir = ses_dir / 'covs'
+    ranked = defaultdict(list)
+    for name in _list_dir(str(covs_dir)):
+        for rank, pattern in enumerate(timing_patterns):
+            match = pattern.fullmatch(name)
+            if match:
+                key = (int(match.group('run')), match.group('cat'))
+                ranked[key].append((rank, covs_dir / name))
+                break
+    timing_files = {key: [path for _, path in sorted(paths)] for key, paths in ranked.items()}
+    
+    return runs, timing_files
+
+
+def find_runs(subject, session, base_dir=BASE_DIR):
+    """Find available functional runs"""
+    return list(_index_session(subject, session, base_dir)[0])
 
 
 def load_func_data(subject, session, run, base_dir=BASE_DIR):
-    """Load preprocessed functional data"""
+    """Load preprocessed functional data
+    
+    The image is opened lazily; voxels are only read through img.dataobj.
+    If the run has been converted with nifti_to_zarr (and zarr is installed),
+    img.dataobj is the Zarr array, so a block window only decompresses the
+    time chunks it overlaps. Otherwise uncompressed data is memory-mapped,
+    and for .nii.gz the file handle is kept open so successive forward reads
+    continue one gzip stream rather than decompressing from the start of the
+    file each time.
+    """
     func_path = (base_dir / subject / f'ses-{session:02d}' / 'derivatives' / 
                  'fsl' / 'loc' / f'run-{run:02d}.feat' / 'filtered_func_data_reg.nii.gz')
     
+    zarr_path = zarr_store_path(func_path)
+    if ZARR_AVAILABLE and zarr_path.exists():
+        z = zarr.open(str(zarr_path), mode='r')
+        return nib.Nifti1Image(z, np.array(z.attrs['affine']))
+    
     if not func_path.exists():
         raise FileNotFoundError(f"Not found: {func_path}")
     
-    return load_img(str(func_path))
+    return nib.load(str(func_path), mmap=True, keep_file_open=True)
+
+
+def zarr_store_path(func_path):
+    """Zarr store next to a functional NIfTI (run.nii.gz -> run.zarr)"""
+    func_path = Path(func_path)
+    return func_path.with_name(func_path.name.split('.')[0] + '.zarr')
+
+
+def nifti_to_zarr(func_path, time_chunk=ZARR_TIME_CHUNK):
+    """One-time conversion of a 4D functional NIfTI to a time-chunked Zarr store
+    
+    Chunks are whole volumes stacked time_chunk deep, so a block window
+    reads only the chunks that overlap it. The data are copied one chunk at
+    a time (the run is never fully in memory) as float32, with the affine
+    stored in the array attributes. load_func_data uses the store from then on.
+    
+    Returns
+    -------
+    zarr_path : Path
+        Location of the store
+    """
+    func_img = nib.load(str(func_path), mmap=True, keep_file_open=True)
+    zarr_path = zarr_store_path(func_path)
+    
+    z = zarr.open(str(zarr_path), mode='w', shape=func_img.shape, 
+                  chunks=func_img.shape[:3] + (time_chunk,), dtype='float32')
+    for start in range(0, func_img.shape[-1], time_chunk):
+        end = min(start + time_chunk, func_img.shape[-1])
+        z[..., start:end] = np.asarray(func_img.dataobj[..., start:end], dtype=np.float32)
+    z.attrs['affine'] = func_img.affine.tolist()
+    
+    return zarr_path
 
 
 def load_zstat(subject, session, cope_num, base_dir=BASE_DIR):
@@ -166,10 +287,10 @@ def load_roi_mask(subject, session, roi_name, hemisphere=None, base_dir=BASE_DIR
             f'bilateral_{roi_name}.nii.gz',
         ]
     
+    available = _list_dir(str(roi_dir))
     for pattern in patterns:
-        mask_path = roi_dir / pattern
-        if mask_path.exists():
-            return load_img(str(mask_path))
+        if pattern in available:
+            return load_img(str(roi_dir / pattern))
     
     return None
 
@@ -180,27 +301,15 @@ def load_timing(subject, session, run, category, base_dir=BASE_DIR):
     Expected file format: onset duration [amplitude]
     Returns array of shape (n_blocks, 2) with onset and duration
     """
-    covs_dir = base_dir / subject / f'ses-{session:02d}' / 'covs'
-    
-    # Try various naming patterns
-    sub_num = subject.replace('sub-', '').lstrip('0')
-    patterns = [
-        f'catloc_{subject}_run-0{run}_{category}.txt',
-        f'catloc_{sub_num}_run-0{run}_{category}.txt',
-        f'{category}_run{run}.txt',
-        f'run{run}_{category}.txt',
-    ]
-    
-    for pattern in patterns:
-        timing_path = covs_dir / pattern
-        if timing_path.exists():
-            try:
-                data = np.loadtxt(str(timing_path))
-                if data.ndim == 1:
-                    data = data.reshape(1, -1)
-                return data[:, :2]  # onset, duration
-            except Exception as e:
-                print(f"    Warning: Could not parse {timing_path}: {e}")
+    timing_files = _index_session(subject, session, base_dir)[1]
+    for timing_path in timing_files.get((run, category), []):
+        try:
+            data = np.loadtxt(str(timing_path))
+            if data.ndim == 1:
+                data = data.reshape(1, -1)
+            return data[:, :2]  # onset, duration
+        except Exception as e:
+            print(f"    Warning: Could not parse {timing_path}: {e}")
     
     return None
 
@@ -209,7 +318,44 @@ def load_timing(subject, session, run, category, base_dir=BASE_DIR):
 # BLOCK PATTERN EXTRACTION
 # =============================================================================
 
-def extract_block_patterns_from_4d(func_img, timing, tr=TR, hrf_delay=HRF_DELAY):
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _block_mean_kernel(block, out):
+        """out[v] = mean of block[v, :], accumulated in one pass per voxel"""
+        n_vols = block.shape[1]
+        for v in prange(block.shape[0]):
+            acc = 0.0
+            for t in range(n_vols):
+                acc += block[v, t]
+            out[v] = acc / n_vols
+    
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dice_kernel(a, b, threshold):
+        """Intersection and summed sizes of (a > threshold) and (b > threshold)"""
+        inter = 0
+        total = 0
+        for i in prange(a.size):
+            ba = a[i] > threshold
+            bb = b[i] > threshold
+            inter += ba and bb
+            total += ba + bb
+        return inter, total
+
+
+def block_windows(timing, n_vols, tr=TR, hrf_delay=HRF_DELAY):
+    """Start/end volumes of each non-empty block window
+    
+    Windows are shifted by the hemodynamic delay and clipped to the run.
+    """
+    timing = np.atleast_2d(timing)
+    start_vols = np.floor((timing[:, 0] + hrf_delay) / tr).astype(int).clip(0, n_vols)
+    end_vols = np.ceil((timing[:, 0] + timing[:, 1] + hrf_delay) / tr).astype(int).clip(0, n_vols)
+    valid = end_vols > start_vols
+    return start_vols[valid], end_vols[valid]
+
+
+def extract_block_patterns_from_4d(func_img, timing, tr=TR, hrf_delay=HRF_DELAY, mask=None,
+                                   out=None):
     """Extract mean pattern for each block from 4D functional data
     
     Parameters
@@ -218,36 +364,40 @@ def extract_block_patterns_from_4d(func_img, timing, tr=TR, hrf_delay=HRF_DELAY)
         4D functional data
     timing : array (n_blocks, 2)
         Block onsets and durations in seconds
+    mask : bool array (x, y, z), optional
+        If given, only voxels inside the mask are kept
+    out : array, optional
+        Preallocated array to write the patterns into (one row per
+        non-empty block window, see block_windows)
         
     Returns
     -------
-    patterns : array (n_blocks, x, y, z)
-        Block-averaged 3D patterns
+    patterns : array (n_blocks, x, y, z), or (n_blocks, n_mask_voxels) with a mask
+        Block-averaged patterns (float32)
     """
-    data = get_data(func_img)
-    n_vols = data.shape[-1]
-    
-    patterns = []
-    for onset, duration in timing:
-        # Account for hemodynamic delay
-        start_time = onset + hrf_delay
-        end_time = onset + duration + hrf_delay
-        
-        start_vol = int(np.floor(start_time / tr))
-        end_vol = int(np.ceil(end_time / tr))
-        
-        start_vol = max(0, start_vol)
-        end_vol = min(n_vols, end_vol)
-        
-        if end_vol > start_vol:
-            block_mean = np.mean(data[..., start_vol:end_vol], axis=-1)
-            patterns.append(block_mean)
+    start_vols, end_vols = block_windows(timing, func_img.shape[-1], tr, hrf_delay)
+    
+    if out is None:
+        pattern_shape = func_img.shape[:3] if mask is None else (np.count_nonzero(mask),)
+        out = np.empty((len(start_vols),) + pattern_shape, dtype=np.float32)
+    
+    # Read only the volumes inside each block window through the image's
+    # data proxy (never the whole run), in onset order so reads of a gzipped
+    # file only ever seek forward
+    for b in np.argsort(start_vols, kind='stable'):
+        block = np.asarray(func_img.dataobj[..., start_vols[b]:end_vols[b]], dtype=np.float32)
+        if mask is not None:
+            block = block[mask]
+        if NUMBA_AVAILABLE and out[b].flags.c_contiguous:
+            _block_mean_kernel(block.reshape(-1, block.shape[-1]), out[b].reshape(-1))
+        else:
+            out[b] = block.mean(axis=-1)
     
-    return np.array(patterns)
+    return out
 
 
 def prepare_decoding_data(subject, session, target_category, contrast_category='scramble',
-                          base_dir=BASE_DIR):
+                          base_dir=BASE_DIR, mask_data=None):
     """Prepare data for binary classification
     
     Parameters
@@ -256,11 +406,13 @@ def prepare_decoding_data(subject, session, target_category, contrast_category='
         Category to decode (face, word, object, house)
     contrast_category : str
         Baseline category (default: scramble)
+    mask_data : array (x, y, z), optional
+        Brain mask; if given, X is restricted to the voxels inside it
         
     Returns
     -------
-    X : array (n_samples, x, y, z)
-        Block patterns
+    X : array (n_samples, n_mask_voxels), or (n_samples, x, y, z) without a mask
+        Block patterns (float32)
     y : array (n_samples,)
         Labels (1 for target, 0 for contrast)
     groups : array (n_samples,)
@@ -273,9 +425,11 @@ def prepare_decoding_data(subject, session, target_category, contrast_category='
     if not runs:
         raise ValueError(f"No runs found for {subject} ses-{session}")
     
-    all_X = []
-    all_y = []
-    all_groups = []
+    mask = mask_data > 0 if mask_data is not None else None
+    
+    # First pass: open runs (headers only) and count their blocks, so X can
+    # be allocated once
+    run_blocks = []  # (run, func_img, target_timing, contrast_timing, n_target, n_contrast)
     affine = None
     
     for run in runs:
@@ -293,55 +447,213 @@ def prepare_decoding_data(subject, session, target_category, contrast_category='
                 print(f"    Skipping run {run}: missing timing files")
                 continue
             
-            # Extract patterns
-            target_patterns = extract_block_patterns_from_4d(func_img, target_timing)
-            contrast_patterns = extract_block_patterns_from_4d(func_img, contrast_timing)
-            
-            # Combine
-            n_target = len(target_patterns)
-            n_contrast = len(contrast_patterns)
-            
-            all_X.extend(target_patterns)
-            all_X.extend(contrast_patterns)
-            all_y.extend([1] * n_target)
-            all_y.extend([0] * n_contrast)
-            all_groups.extend([run] * (n_target + n_contrast))
+            n_vols = func_img.shape[-1]
+            n_target = len(block_windows(target_timing, n_vols)[0])
+            n_contrast = len(block_windows(contrast_timing, n_vols)[0])
+            run_blocks.append((run, func_img, target_timing, contrast_timing, 
+                               n_target, n_contrast))
             
         except Exception as e:
             print(f"    Error in run {run}: {e}")
             continue
     
-    if not all_X:
+    n_samples = sum(n_target + n_contrast for *_, n_target, n_contrast in run_blocks)
+    if n_samples == 0:
         raise ValueError(f"No valid data extracted for {subject} ses-{session}")
     
-    return np.array(all_X), np.array(all_y), np.array(all_groups), affine
+    pattern_shape = run_blocks[0][1].shape[:3] if mask is None else (np.count_nonzero(mask),)
+    X = np.empty((n_samples,) + pattern_shape, dtype=np.float32)
+    y = np.empty(n_samples, dtype=int)
+    groups = np.empty(n_samples, dtype=int)
+    keep = np.ones(n_samples, dtype=bool)
+    
+    # Second pass: write each run's target then contrast patterns straight
+    # into their rows
+    row = 0
+    for run, func_img, target_timing, contrast_timing, n_target, n_contrast in run_blocks:
+        split, end = row + n_target, row + n_target + n_contrast
+        try:
+            extract_block_patterns_from_4d(func_img, target_timing, mask=mask, out=X[row:split])
+            extract_block_patterns_from_4d(func_img, contrast_timing, mask=mask, out=X[split:end])
+        except Exception as e:
+            print(f"    Error in run {run}: {e}")
+            keep[row:end] = False
+        y[row:split] = 1
+        y[split:end] = 0
+        groups[row:end] = run
+        row = end
+    
+    if not keep.all():
+        X, y, groups = X[keep], y[keep], groups[keep]
+        if len(y) == 0:
+            raise ValueError(f"No valid data extracted for {subject} ses-{session}")
+    
+    return X, y, groups, affine
 
 
 # =============================================================================
 # SEARCHLIGHT ANALYSIS
 # =============================================================================
 
+def masked_samples(X, mask_data):
+    """Samples as an (n_samples, n_mask_voxels) matrix
+    
+    X from prepare_decoding_data with a mask is already in this form;
+    4D block patterns (n_samples, x, y, z) are flattened and masked here.
+    """
+    if X.ndim == 2:
+        return X
+    return X.reshape(X.shape[0], -1)[:, mask_data.ravel() > 0]
+
+
+def mask_coords_mm(mask_img):
+    """World coordinates (mm) of the mask voxels, in C order"""
+    return nib.affines.apply_affine(mask_img.affine, np.argwhere(get_data(mask_img) > 0))
+
+
+def searchlight_neighbourhoods(mask_img, radius=SEARCHLIGHT_RADIUS, centers=None):
+    """Mask voxels within radius (mm) of each sphere center, as CSR arrays
+    
+    Centers and members are numbered like the columns of masked samples
+    (mask voxels in C order); centers defaults to every mask voxel. Sphere
+    i (the i-th center) covers columns indices[indptr[i]:indptr[i + 1]].
+    Depends only on the mask and radius, so it can be computed once and reused.
+    """
+    coords_mm = mask_coords_mm(mask_img)
+    center_mm = coords_mm if centers is None else coords_mm[centers]
+    graph = NearestNeighbors(radius=radius).fit(coords_mm).radius_neighbors_graph(center_mm)
+    return graph.indptr, graph.indices
+
+
+def fold_column_stats(X, splits):
+    """Training-set column means and standard deviations of every CV fold
+    
+    Column sums over all samples are taken once; each fold then subtracts
+    the sums over its test rows instead of rescanning its training rows.
+    Sums are accumulated in float64 on globally centered data so that
+    E[x^2] - E[x]^2 stays accurate for raw BOLD intensities.
+    
+    Returns
+    -------
+    means, scales : arrays (n_folds, n_features)
+        As fitted by StandardScaler on each training set (a zero std,
+        i.e. a column constant over the training set, gives a scale of 1)
+    """
+    center = X.mean(axis=0, dtype=np.float64)
+    Xc = X - center
+    total_sum = Xc.sum(axis=0)
+    total_sq = np.einsum('ij,ij->j', Xc, Xc)
+    
+    means = np.empty((len(splits), X.shape[1]), dtype=X.dtype)
+    scales = np.empty_like(means)
+    for f, (train_idx, test_idx) in enumerate(splits):
+        X_test = Xc[test_idx]
+        mean_c = (total_sum - X_test.sum(axis=0)) / len(train_idx)
+        var = (total_sq - np.einsum('ij,ij->j', X_test, X_test)) / len(train_idx) - mean_c ** 2
+        # Rounding leaves ~1e-16 relative residue where the true variance is 0
+        constant = var <= 1e-12 * mean_c ** 2
+        means[f] = mean_c + center
+        scales[f] = np.where(constant, 1.0, np.sqrt(np.maximum(var, 0)))
+    
+    return means, scales
+
+
+def _score_spheres(X, y, splits, fold_means, fold_scales, indptr, indices, centers):
+    """Mean CV accuracy of a standardized LinearSVC for each sphere center"""
+    clf = LinearSVC(C=1, dual=True, max_iter=2000, tol=1e-3)
+    scores = np.empty(len(centers), dtype=np.float32)
+    for i, center in enumerate(centers):
+        cols = indices[indptr[center]:indptr[center + 1]]
+        X_sphere = X[:, cols]
+        fold_scores = []
+        for f, (train_idx, test_idx) in enumerate(splits):
+            X_scaled = (X_sphere - fold_means[f, cols]) / fold_scales[f, cols]
+            clf.fit(X_scaled[train_idx], y[train_idx])
+            fold_scores.append(clf.score(X_scaled[test_idx], y[test_idx]))
+        scores[i] = np.mean(fold_scores)
+    return scores
+
+
+def shared_memmap(arr, dir_path, name):
+    """Dump arr to dir_path and return it as a read-only memmap"""
+    path = os.path.join(dir_path, f'{name}.npy')
+    np.save(path, arr)
+    return np.load(path, mmap_mode='r')
+
+
+def build_mask_context(mask_img, radius=SEARCHLIGHT_RADIUS, stride=1):
+    """Searchlight geometry for one mask, shared by every run on it
+    
+    Sphere centers, their neighbourhoods and the nearest-center fill depend
+    only on the mask, radius and stride (not on the data), so a subject's
+    categories and sessions can all reuse one context.
+    
+    Returns
+    -------
+    ctx : dict
+        mask_data, and indptr/indices of the sphere neighbourhoods (see
+        searchlight_neighbourhoods); nearest maps each mask voxel to the
+        center whose score it takes (None when every voxel is a center)
+    """
+    mask_data = get_data(mask_img)
+    
+    centers = None
+    if stride > 1:
+        on_grid = np.all(np.argwhere(mask_data > 0) % stride == 0, axis=1)
+        if on_grid.any():
+            centers = np.flatnonzero(on_grid)
+    indptr, indices = searchlight_neighbourhoods(mask_img, radius, centers)
+    
+    nearest = None
+    if centers is not None:
+        # Nearest-center fill for the voxels that are not centers
+        coords_mm = mask_coords_mm(mask_img)
+        nearest = NearestNeighbors(n_neighbors=1).fit(coords_mm[centers]).kneighbors(
+            coords_mm, return_distance=False)[:, 0]
+    
+    return {'mask_data': mask_data, 'indptr': indptr, 'indices': indices, 
+            'nearest': nearest}
+
+
 def run_searchlight(X, y, mask_img, groups=None, radius=SEARCHLIGHT_RADIUS, 
-                    n_jobs=-1, verbose=1):
+                    n_jobs=-1, verbose=1, batch_size=256, stride=1, ctx=None):
     """Run searchlight classification
     
+    Every mask voxel is a sphere center (or, with stride > 1, the mask voxels
+    on every stride-th grid point along each axis; the other voxels take the
+    score of the nearest center). Neighbourhoods are indexed once
+    (searchlight_neighbourhoods), the samples stay one flat matrix, and
+    centers are scored in batches of batch_size per joblib task.
+    
     Parameters
     ----------
-    X : array (n_samples, x, y, z)
-        4D data array
+    X : array (n_samples, x, y, z) or (n_samples, n_mask_voxels)
+        Block patterns, as volumes or restricted to the mask voxels
     y : array (n_samples,)
         Labels
     mask_img : Nifti image
         Brain mask
     groups : array, optional
         Group labels for leave-one-group-out CV
+    stride : int
+        Center spacing in voxels; stride=2 fits 8x fewer spheres, stride=3
+        27x fewer. Spheres still use every mask voxel within the radius.
+    ctx : dict, optional
+        Precomputed build_mask_context(mask_img, radius, stride); built here
+        if not given (radius and stride are then ignored)
         
     Returns
     -------
     accuracy_img : Nifti image
         Searchlight accuracy map
     """
-    # Set up cross-validation
+    if ctx is None:
+        ctx = build_mask_context(mask_img, radius, stride)
+    mask_data = ctx['mask_data']
+    indptr, indices = ctx['indptr'], ctx['indices']
+    X = masked_samples(X, mask_data).astype(np.float32, copy=False)
+    
+    # Set up cross-validation (same folds for every sphere)
     if groups is not None and len(np.unique(groups)) >= 2:
         # Use leave-one-run-out
         cv = LeaveOneGroupOut()
@@ -349,29 +661,84 @@ def run_searchlight(X, y, mask_img, groups=None, radius=SEARCHLIGHT_RADIUS,
         # Use stratified shuffle split
         cv = StratifiedShuffleSplit(n_splits=N_CV_FOLDS, test_size=TEST_SIZE, 
                                      random_state=42)
+    splits = list(cv.split(X, y, groups))
+    
+    # Per-fold standardization of every voxel, computed once for all spheres
+    fold_means, fold_scales = fold_column_stats(X, splits)
+    
+    # Batches of centers per task. The samples, fold statistics and
+    # neighbourhood index are written once to shared memory and handed to
+    # the workers as read-only memmaps (pickled by file name, not by content)
+    n_centers = len(indptr) - 1
+    batches = np.array_split(np.arange(n_centers), max(1, -(-n_centers // batch_size)))
+    with tempfile.TemporaryDirectory(dir=SHM_DIR) as tmp_dir:
+        shared = [shared_memmap(arr, tmp_dir, name) for arr, name in 
+                  ((X, 'X'), (fold_means, 'means'), (fold_scales, 'scales'), (indices, 'indices'))]
+        X_shared, means_shared, scales_shared, indices_shared = shared
+        scores = Parallel(n_jobs=n_jobs, verbose=verbose, max_nbytes=None)(
+            delayed(_score_spheres)(X_shared, y, splits, means_shared, scales_shared,
+                                    indptr, indices_shared, batch)
+            for batch in batches
+        )
+        del shared, X_shared, means_shared, scales_shared, indices_shared
+    
+    scores = np.concatenate(scores)
+    if ctx['nearest'] is not None:
+        scores = scores[ctx['nearest']]
+    
+    accuracy = np.zeros(mask_data.shape, dtype=np.float32)
+    accuracy[mask_data > 0] = scores
+    return new_img_like(mask_img, accuracy)
+
+
+def _linear_fold_score(X, y, train_idx, test_idx, mean=None, scale=None):
+    """Accuracy of StandardScaler + linear SVC on one fold, via its linear kernel
     
-    # Set up classifier
-    clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
-    
-    # Create searchlight
-    sl = SearchLight(
-        mask_img=mask_img,
-        radius=radius,
-        estimator=clf,
-        cv=cv,
-        n_jobs=n_jobs,
-        verbose=verbose
-    )
-    
-    # Convert X to list of 3D images for nilearn
-    # SearchLight expects a list of Nifti images or a 4D image
-    sample_imgs = [new_img_like(mask_img, x) for x in X]
-    X_4d = concat_imgs(sample_imgs)
-    
-    # Fit
-    sl.fit(X_4d, y, groups)
+    mean and scale are the training-set column statistics (see
+    fold_column_stats); computed from X[train_idx] if not given.
+    """
+    if mean is None:
+        X_train = X[train_idx]
+        mean = X_train.mean(axis=0)
+        scale = X_train.std(axis=0)
+        scale[scale == 0] = 1.0
+    X_scaled = (X - mean) / scale
+    
+    # One product gives the train and test rows of the kernel
+    X_train = X_scaled[train_idx]
+    K = X_scaled[np.concatenate([train_idx, test_idx])] @ X_train.T
+    n_train = len(train_idx)
+    
+    clf = SVC(kernel='precomputed', C=1)
+    clf.fit(K[:n_train], y[train_idx])
+    return clf.score(K[n_train:], y[test_idx])
+
+
+def linear_cv_scores(X, y, cv, groups=None, n_jobs=-1):
+    """Per-fold accuracy of a standardized linear SVM
+    
+    Same scores as cross_val_score(make_pipeline(StandardScaler(),
+    SVC(kernel='linear', C=1)), X, y, cv=cv, groups=groups), but each fold
+    trains on an (n_train, n_train) kernel rather than the voxel patterns,
+    and folds run in threads (BLAS and libsvm release the GIL). The
+    per-fold scaler statistics come from one pass over X (fold_column_stats).
+    """
+    splits = list(cv.split(X, y, groups))
+    means, scales = fold_column_stats(X, splits)
+    return np.array(Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_linear_fold_score)(X, y, train_idx, test_idx, means[f], scales[f])
+        for f, (train_idx, test_idx) in enumerate(splits)
+    ))
+
+
+def nonconstant_columns(X):
+    """Columns of X with non-zero variance
     
-    return sl.scores_img_
+    Only the sign matters, so the centered sum of squares is compared to 0
+    directly: one fused einsum reduction, no std (sqrt/divide) pass.
+    """
+    X_centered = X - X.mean(axis=0)
+    return np.einsum('ij,ij->j', X_centered, X_centered) > 0
 
 
 def roi_based_decoding(X, y, mask_data, groups=None):
@@ -379,17 +746,12 @@ def roi_based_decoding(X, y, mask_data, groups=None):
     
     Returns mean accuracy within mask
     """
-    # Flatten spatial dimensions
+    # Restrict to mask voxels (no-op if X is already masked)
     n_samples = X.shape[0]
-    X_flat = X.reshape(n_samples, -1)
-    
-    # Apply mask
-    mask_flat = mask_data.flatten() > 0
-    X_masked = X_flat[:, mask_flat]
+    X_masked = masked_samples(X, mask_data)
     
     # Remove zero-variance features
-    feature_std = np.std(X_masked, axis=0)
-    valid_features = feature_std > 0
+    valid_features = nonconstant_columns(X_masked)
     
     if np.sum(valid_features) < 10:
         print("    Warning: Too few valid features")
@@ -405,8 +767,7 @@ def roi_based_decoding(X, y, mask_data, groups=None):
                                      random_state=42)
     
     # Classify
-    clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
-    scores = cross_val_score(clf, X_masked, y, cv=cv, groups=groups)
+    scores = linear_cv_scores(X_masked, y, cv, groups)
     
     return {
         'accuracy': np.mean(scores),
@@ -422,11 +783,17 @@ def roi_based_decoding(X, y, mask_data, groups=None):
 
 def compute_dice(map1, map2, threshold=0.55):
     """Compute Dice coefficient between thresholded accuracy maps"""
-    bin1 = map1 > threshold
-    bin2 = map2 > threshold
+    # Stored accuracy maps are float16; compare them at float32
+    map1, map2 = (m.astype(np.float32) if m.dtype == np.float16 else m for m in (map1, map2))
     
-    intersection = np.sum(np.logical_and(bin1, bin2))
-    total = np.sum(bin1) + np.sum(bin2)
+    if NUMBA_AVAILABLE:
+        intersection, total = _dice_kernel(np.ravel(map1), np.ravel(map2), threshold)
+    else:
+        bin1 = map1 > threshold
+        bin2 = map2 > threshold
+        
+        intersection = np.count_nonzero(bin1 & bin2)
+        total = np.count_nonzero(bin1) + np.count_nonzero(bin2)
     
     if total == 0:
         return 0.0
@@ -439,31 +806,28 @@ def cross_temporal_generalization(X1, y1, X2, y2, mask_data):
     
     Train on session 1, test on session 2 (and vice versa)
     """
-    # Flatten and mask
-    mask_flat = mask_data.flatten() > 0
-    
-    X1_flat = X1.reshape(X1.shape[0], -1)[:, mask_flat]
-    X2_flat = X2.reshape(X2.shape[0], -1)[:, mask_flat]
+    # Restrict to mask voxels (no-op if X1/X2 are already masked)
+    X1_flat = masked_samples(X1, mask_data)
+    X2_flat = masked_samples(X2, mask_data)
     
     # Remove zero-variance features (using training data statistics)
-    feature_std = np.std(X1_flat, axis=0)
-    valid = feature_std > 0
+    valid = nonconstant_columns(X1_flat)
     
     if np.sum(valid) < 10:
         return {'forward': 0.5, 'backward': 0.5, 'mean': 0.5}
     
-    X1_valid = X1_flat[:, valid]
-    X2_valid = X2_flat[:, valid]
-    
-    clf = make_pipeline(StandardScaler(), SVC(kernel='linear', C=1))
+    # Both sessions in one matrix; each direction is then a single "fold"
+    # standardized on its training session and fit on the linear kernel
+    X_both = np.concatenate([X1_flat[:, valid], X2_flat[:, valid]])
+    y_both = np.concatenate([y1, y2])
+    ses1 = np.arange(len(y1))
+    ses2 = np.arange(len(y1), len(y_both))
     
     # Forward: train ses1 → test ses2
-    clf.fit(X1_valid, y1)
-    forward_acc = clf.score(X2_valid, y2)
+    forward_acc = _linear_fold_score(X_both, y_both, ses1, ses2)
     
     # Backward: train ses2 → test ses1
-    clf.fit(X2_valid, y2)
-    backward_acc = clf.score(X1_valid, y1)
+    backward_acc = _linear_fold_score(X_both, y_both, ses2, ses1)
     
     return {
         'forward': forward_acc,
@@ -477,7 +841,7 @@ def cross_temporal_generalization(X1, y1, X2, y2, mask_data):
 # =============================================================================
 
 def analyze_subject(subject, categories=None, use_searchlight=False, 
-                    base_dir=BASE_DIR, output_dir=OUTPUT_DIR):
+                    base_dir=BASE_DIR, output_dir=OUTPUT_DIR, stride=1):
     """Run complete analysis for one subject
     
     Parameters
@@ -488,6 +852,8 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
         Categories to analyze (default: all four)
     use_searchlight : bool
         If True, run full searchlight. If False, run faster ROI-based analysis.
+    stride : int
+        Searchlight center spacing in voxels (1 = every voxel; see run_searchlight)
     """
     categories = categories or ['face', 'word', 'object', 'house']
     
@@ -521,6 +887,9 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
         print(f"Error creating mask: {e}")
         return None
     
+    # Searchlight geometry is the same for every category and session
+    sl_ctx = build_mask_context(mask_img, stride=stride) if use_searchlight else None
+    
     for category in categories:
         print(f"\n--- {category.upper()} ---")
         cat_type = 'unilateral' if category in ['face', 'word'] else 'bilateral'
@@ -537,7 +906,7 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
             
             try:
                 X, y, groups, affine = prepare_decoding_data(
-                    subject, ses, category, 'scramble', base_dir
+                    subject, ses, category, 'scramble', base_dir, mask_data=mask_data
                 )
                 
                 session_data[ses] = {'X': X, 'y': y, 'groups': groups}
@@ -546,13 +915,16 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
                 
                 if use_searchlight:
                     # Full searchlight (slow)
-                    acc_img = run_searchlight(X, y, mask_img, groups, n_jobs=-1, verbose=0)
+                    acc_img = run_searchlight(X, y, mask_img, groups, n_jobs=-1, verbose=0,
+                                              ctx=sl_ctx)
                     acc_data = get_data(acc_img)
                     
+                    # The map is kept (for Dice) as float16: accuracies
+                    # need no more than ~1e-3 precision
                     cat_results['sessions'][ses] = {
                         'mean_accuracy': np.mean(acc_data[mask_data > 0]),
                         'max_accuracy': np.max(acc_data[mask_data > 0]),
-                        'accuracy_map': acc_data
+                        'accuracy_map': acc_data.astype(np.float16)
                     }
                 else:
                     # Faster ROI-based analysis
@@ -604,7 +976,7 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Save as CSV-friendly format
+    # Save as a flat table (one row per category)
     rows = []
     for cat, cat_results in results['categories'].items():
         row = {
@@ -632,31 +1004,65 @@ def analyze_subject(subject, categories=None, use_searchlight=False,
         rows.append(row)
     
     df = pd.DataFrame(rows)
-    csv_path = output_dir / f'{subject}_decoding_results.csv'
-    df.to_csv(csv_path, index=False)
-    print(f"\nSaved: {csv_path}")
+    parquet_path = output_dir / f'{subject}_decoding_results.parquet'
+    df.to_parquet(parquet_path, engine='pyarrow', compression='zstd', index=False)
+    print(f"\nSaved: {parquet_path}")
     
     return results, df
 
 
-def run_all_subjects(use_searchlight=False, base_dir=BASE_DIR, output_dir=OUTPUT_DIR):
-    """Run analysis for all subjects"""
+def _init_subject_worker(blas_threads):
+    """Cap BLAS threads in a subject worker so the pool does not oversubscribe"""
+    threadpool_limits(blas_threads)
+
+
+def _analyze_subject_to_file(subject, **kwargs):
+    """analyze_subject in a pool worker; returns only the path of the saved table
+    
+    Keeps the full results (including searchlight maps) out of the pickle
+    sent back to the parent.
+    """
+    if analyze_subject(subject, **kwargs) is None:
+        raise RuntimeError("analysis returned no results")
+    return Path(kwargs.get('output_dir', OUTPUT_DIR)) / f'{subject}_decoding_results.parquet'
+
+
+def run_all_subjects(use_searchlight=False, base_dir=BASE_DIR, output_dir=OUTPUT_DIR,
+                     n_workers=None, blas_threads=2):
+    """Run analysis for all subjects
+    
+    Subjects are independent, so they run in a process pool of n_workers
+    (default: half the CPUs for ROI decoding; 1 with the searchlight, which
+    already uses every core within a subject). Each worker is limited to
+    blas_threads BLAS threads.
+    """
     
     all_subjects = (list(OTC_SUBJECTS.keys()) + NON_OTC_SUBJECTS + CONTROL_SUBJECTS)
     
-    all_dfs = []
+    if n_workers is None:
+        n_workers = 1 if use_searchlight else max(1, (os.cpu_count() or 2) // 2)
+    n_workers = min(n_workers, len(all_subjects))
     
-    for subject in all_subjects:
-        try:
-            result, df = analyze_subject(subject, use_searchlight=use_searchlight,
-                                         base_dir=base_dir, output_dir=output_dir)
-            all_dfs.append(df)
-        except Exception as e:
-            print(f"\nFailed to process {subject}: {e}")
+    subject_files = []
+    
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_subject_worker,
+                             initargs=(blas_threads,)) as executor:
+        futures = [executor.submit(_analyze_subject_to_file, subject, 
+                                   use_searchlight=use_searchlight,
+                                   base_dir=base_dir, output_dir=output_dir)
+                   for subject in all_subjects]
+        
+        # Collect in subject order so the combined table keeps a stable row order
+        for subject, future in zip(all_subjects, futures):
+            try:
+                subject_files.append(str(future.result()))
+            except Exception as e:
+                print(f"\nFailed to process {subject}: {e}")
     
-    # Combine all results
-    if all_dfs:
-        combined_df = pd.concat(all_dfs, ignore_index=True)
+    # Combine all results (read back from the per-subject Parquet files; the
+    # combined table is also written as CSV for the group analysis)
+    if subject_files:
+        combined_df = pd.concat([pd.read_parquet(f) for f in subject_files], ignore_index=True)
         combined_path = Path(output_dir) / 'all_subjects_decoding_results.csv'
         combined_df.to_csv(combined_path, index=False)
         print(f"\n{'='*60}")
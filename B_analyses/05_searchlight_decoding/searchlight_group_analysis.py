@@ -35,6 +35,8 @@ try:
     import statsmodels.api as sm
     import statsmodels.formula.api as smf
     from statsmodels.stats.multitest import multipletests
+    from statsmodels.regression.mixed_linear_model import MixedLMParams
+    from patsy import dmatrix
     STATSMODELS_AVAILABLE = True
 except ImportError:
     STATSMODELS_AVAILABLE = False
@@ -48,6 +50,8 @@ except ImportError:
 OUTPUT_DIR = Path('/user_data/csimmon2/git_repos/long_pt/B_analyses/searchlight_decoding')
 ALPHA = 0.05
 N_BOOTSTRAP = 10000
+RANDOM_SEED = 42
+PERMUTATION_CHUNK = 1000  # permutations drawn per block in bootstrap_diff_test
 
 
 # =============================================================================
@@ -73,6 +77,12 @@ def prepare_data_for_analysis(df):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce')
     
+    # Categorical labels so every filter/groupby compares integer codes
+    # (categories stay sorted, so patsy's reference levels are unchanged)
+    for col in ['group', 'category_type', 'category']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    
     # Add binary coding
     df['is_bilateral'] = (df['category_type'] == 'bilateral').astype(int)
     df['is_otc'] = (df['group'] == 'OTC').astype(int)
@@ -80,23 +90,70 @@ def prepare_data_for_analysis(df):
     return df
 
 
+def split_cells(df, by):
+    """Rows of df for each combination of the `by` columns, from one groupby
+    
+    Returns a dict keyed by value tuples; look metrics up with cell_values.
+    """
+    return {key: rows for key, rows in df.groupby(by, sort=False, observed=True)}
+
+
+def cell_values(cells, key, metric):
+    """One metric of a split_cells cell (empty if no rows had that key)"""
+    rows = cells.get(key)
+    return rows[metric] if rows is not None else pd.Series(dtype=float)
+
+
 # =============================================================================
 # STATISTICAL TESTS
 # =============================================================================
 
 def bootstrap_ci(data, n_bootstrap=N_BOOTSTRAP, ci=95, func=np.mean):
-    """Compute bootstrap confidence interval"""
-    data = data.dropna()
-    if len(data) < 2:
-        return np.nan, np.nan, np.nan
+    """Compute bootstrap confidence interval
     
-    bootstrap_samples = np.random.choice(data, size=(n_bootstrap, len(data)), replace=True)
-    bootstrap_stats = func(bootstrap_samples, axis=1)
+    data is one Series/array, or a list of them (cells). All cells are
+    resampled in one batched draw, and a list gives a list of
+    (estimate, lower, upper), one per cell.
+    """
+    if isinstance(data, list):
+        return _bootstrap_ci_cells(data, n_bootstrap, ci, func)
+    return _bootstrap_ci_cells([data], n_bootstrap, ci, func)[0]
+
+
+def _bootstrap_ci_cells(cells, n_bootstrap, ci, func):
+    """Batched bootstrap_ci over a list of cells"""
+    cells = [np.asarray(x, dtype=float) for x in cells]
+    cells = [x[~np.isnan(x)] for x in cells]
+    results = [(np.nan, np.nan, np.nan)] * len(cells)
+    
+    valid = [i for i, x in enumerate(cells) if len(x) >= 2]
+    if not valid:
+        return results
+    
+    # Cells padded to one (n_cells, max_n) array; every cell draws max_n
+    # indices below its own length, and only its first n are used
+    lengths = np.array([len(cells[i]) for i in valid])
+    max_n = lengths.max()
+    padded = np.zeros((len(valid), max_n))
+    for row, i in enumerate(valid):
+        padded[row, :lengths[row]] = cells[i]
+    
+    rng = np.random.default_rng(RANDOM_SEED)
+    idx = rng.integers(0, lengths[:, None, None], size=(len(valid), n_bootstrap, max_n))
+    samples = padded[np.arange(len(valid))[:, None, None], idx]
+    
+    if func is np.mean:
+        in_cell = np.arange(max_n) < lengths[:, None]
+        bootstrap_stats = (samples * in_cell[:, None, :]).sum(axis=-1) / lengths[:, None]
+    else:
+        bootstrap_stats = np.array([func(samples[row, :, :n], axis=1) 
+                                    for row, n in enumerate(lengths)])
     
-    lower = np.percentile(bootstrap_stats, (100 - ci) / 2)
-    upper = np.percentile(bootstrap_stats, 100 - (100 - ci) / 2)
+    lower, upper = np.percentile(bootstrap_stats, [(100 - ci) / 2, 100 - (100 - ci) / 2], axis=1)
     
-    return func(data), lower, upper
+    for row, i in enumerate(valid):
+        results[i] = (func(cells[i]), lower[row], upper[row])
+    return results
 
 
 def bootstrap_diff_test(data1, data2, n_bootstrap=N_BOOTSTRAP):
@@ -112,45 +169,56 @@ def bootstrap_diff_test(data1, data2, n_bootstrap=N_BOOTSTRAP):
     # Pool data for permutation test
     pooled = np.concatenate([data1, data2])
     n1 = len(data1)
-    
-    null_diffs = []
-    for _ in range(n_bootstrap):
-        np.random.shuffle(pooled)
-        null_diff = np.mean(pooled[:n1]) - np.mean(pooled[n1:])
-        null_diffs.append(null_diff)
-    
-    null_diffs = np.array(null_diffs)
-    p_value = np.mean(np.abs(null_diffs) >= np.abs(observed_diff))
+    n2 = len(data2)
+    total = pooled.sum()
+    
+    # Permutations in blocks: row i of perm is the i-th shuffle of pooled.
+    # The difference of means only needs the first group's sum per shuffle.
+    rng = np.random.default_rng(RANDOM_SEED)
+    idx = np.arange(len(pooled))
+    n_extreme = 0
+    for start in range(0, n_bootstrap, PERMUTATION_CHUNK):
+        n_chunk = min(PERMUTATION_CHUNK, n_bootstrap - start)
+        perm = rng.permuted(np.broadcast_to(idx, (n_chunk, len(pooled))), axis=1)
+        sum1 = pooled[perm[:, :n1]].sum(axis=1)
+        null_diffs = sum1 / n1 - (total - sum1) / n2
+        n_extreme += np.count_nonzero(np.abs(null_diffs) >= np.abs(observed_diff))
+    p_value = n_extreme / n_bootstrap
     
     return observed_diff, p_value
 
 
-def within_subject_test(df, group, metric, category_type1, category_type2):
-    """Within-subject comparison of category types"""
+def build_paired_table(df, metrics=('accuracy_change', 'cross_temporal_mean', 'dice_0.55')):
+    """Per-subject mean of each metric by category type, from one pivot
     
-    group_data = df[df['group'] == group]
+    Rows are (group, subject), columns (metric, category_type). Build it once
+    and pass it to within_subject_test for every metric.
+    """
+    metrics = [m for m in metrics if m in df.columns]
+    return df.pivot_table(index=['group', 'subject'], columns='category_type', 
+                          values=metrics, aggfunc='mean', dropna=False,
+                          observed=True)
+
+
+def within_subject_test(df, group, metric, category_type1, category_type2, paired=None):
+    """Within-subject comparison of category types
     
-    # Get data for each subject
-    subjects = group_data['subject'].unique()
+    paired is build_paired_table(df); built here if not given.
+    """
+    if paired is None:
+        paired = build_paired_table(df, [metric])
     
-    diffs = []
-    for sub in subjects:
-        sub_data = group_data[group_data['subject'] == sub]
-        
-        type1_vals = sub_data[sub_data['category_type'] == category_type1][metric].values
-        type2_vals = sub_data[sub_data['category_type'] == category_type2][metric].values
-        
-        if len(type1_vals) > 0 and len(type2_vals) > 0:
-            # Average across categories within each type
-            diff = np.nanmean(type1_vals) - np.nanmean(type2_vals)
-            if not np.isnan(diff):
-                diffs.append(diff)
+    # Per subject: mean over each type's categories, then the difference
+    try:
+        sub_means = paired.loc[group]
+        diffs = (sub_means[(metric, category_type1)] - 
+                 sub_means[(metric, category_type2)]).dropna().to_numpy()
+    except KeyError:
+        diffs = np.array([])
     
     if len(diffs) < 2:
         return {'n': len(diffs), 'mean_diff': np.nan, 'p': np.nan}
     
-    diffs = np.array(diffs)
-    
     # One-sample t-test against 0
     t_stat, p_val = stats.ttest_1samp(diffs, 0)
     
@@ -197,7 +265,7 @@ def run_lmm(df, formula, group=None):
 # MAIN ANALYSIS FUNCTIONS
 # =============================================================================
 
-def test_bilateral_vs_unilateral(df):
+def test_bilateral_vs_unilateral(df, paired=None):
     """Test primary hypothesis: Bilateral categories show more degradation than unilateral
     
     Expected pattern based on ROI findings:
@@ -210,6 +278,8 @@ def test_bilateral_vs_unilateral(df):
     print("="*70)
     
     results = {}
+    if paired is None:
+        paired = build_paired_table(df)
     
     # Test within OTC patients
     print("\n--- OTC Patients (n=6) ---")
@@ -217,18 +287,18 @@ def test_bilateral_vs_unilateral(df):
     # Accuracy change comparison
     print("\nAccuracy Change (Session 2 - Session 1):")
     
-    otc_data = df[df['group'] == 'OTC']
-    bil_change = otc_data[otc_data['category_type'] == 'bilateral']['accuracy_change']
-    uni_change = otc_data[otc_data['category_type'] == 'unilateral']['accuracy_change']
+    cells = split_cells(df, ['group', 'category_type'])
+    bil_change = cell_values(cells, ('OTC', 'bilateral'), 'accuracy_change')
+    uni_change = cell_values(cells, ('OTC', 'unilateral'), 'accuracy_change')
     
-    bil_mean, bil_low, bil_high = bootstrap_ci(bil_change)
-    uni_mean, uni_low, uni_high = bootstrap_ci(uni_change)
+    (bil_mean, bil_low, bil_high), (uni_mean, uni_low, uni_high) = bootstrap_ci(
+        [bil_change, uni_change])
     
     print(f"  Bilateral (Object, House): {bil_mean:.3f} [{bil_low:.3f}, {bil_high:.3f}]")
     print(f"  Unilateral (Face, Word):   {uni_mean:.3f} [{uni_low:.3f}, {uni_high:.3f}]")
     
     # Within-subject test
-    ws_result = within_subject_test(df, 'OTC', 'accuracy_change', 'bilateral', 'unilateral')
+    ws_result = within_subject_test(df, 'OTC', 'accuracy_change', 'bilateral', 'unilateral', paired)
     print(f"  Within-subject difference: {ws_result['mean_diff']:.3f}")
     print(f"  t({ws_result['n']-1}) = {ws_result['t_stat']:.2f}, p = {ws_result['p_ttest']:.4f}")
     
@@ -244,16 +314,16 @@ def test_bilateral_vs_unilateral(df):
     if 'cross_temporal_mean' in df.columns:
         print("\nCross-Temporal Generalization (Train ses1 → Test ses2):")
         
-        bil_cross = otc_data[otc_data['category_type'] == 'bilateral']['cross_temporal_mean']
-        uni_cross = otc_data[otc_data['category_type'] == 'unilateral']['cross_temporal_mean']
+        bil_cross = cell_values(cells, ('OTC', 'bilateral'), 'cross_temporal_mean')
+        uni_cross = cell_values(cells, ('OTC', 'unilateral'), 'cross_temporal_mean')
         
-        bil_mean, bil_low, bil_high = bootstrap_ci(bil_cross)
-        uni_mean, uni_low, uni_high = bootstrap_ci(uni_cross)
+        (bil_mean, bil_low, bil_high), (uni_mean, uni_low, uni_high) = bootstrap_ci(
+            [bil_cross, uni_cross])
         
         print(f"  Bilateral: {bil_mean:.3f} [{bil_low:.3f}, {bil_high:.3f}]")
         print(f"  Unilateral: {uni_mean:.3f} [{uni_low:.3f}, {uni_high:.3f}]")
         
-        ws_result = within_subject_test(df, 'OTC', 'cross_temporal_mean', 'bilateral', 'unilateral')
+        ws_result = within_subject_test(df, 'OTC', 'cross_temporal_mean', 'bilateral', 'unilateral', paired)
         print(f"  Within-subject difference: {ws_result['mean_diff']:.3f}")
         print(f"  p = {ws_result['p_ttest']:.4f}")
         
@@ -267,16 +337,16 @@ def test_bilateral_vs_unilateral(df):
     if 'dice_0.55' in df.columns and df['dice_0.55'].notna().any():
         print("\nSpatial Map Overlap (Dice @ threshold=0.55):")
         
-        bil_dice = otc_data[otc_data['category_type'] == 'bilateral']['dice_0.55']
-        uni_dice = otc_data[otc_data['category_type'] == 'unilateral']['dice_0.55']
+        bil_dice = cell_values(cells, ('OTC', 'bilateral'), 'dice_0.55')
+        uni_dice = cell_values(cells, ('OTC', 'unilateral'), 'dice_0.55')
         
-        bil_mean, bil_low, bil_high = bootstrap_ci(bil_dice)
-        uni_mean, uni_low, uni_high = bootstrap_ci(uni_dice)
+        (bil_mean, bil_low, bil_high), (uni_mean, uni_low, uni_high) = bootstrap_ci(
+            [bil_dice, uni_dice])
         
         print(f"  Bilateral: {bil_mean:.3f} [{bil_low:.3f}, {bil_high:.3f}]")
         print(f"  Unilateral: {uni_mean:.3f} [{uni_low:.3f}, {uni_high:.3f}]")
         
-        ws_result = within_subject_test(df, 'OTC', 'dice_0.55', 'bilateral', 'unilateral')
+        ws_result = within_subject_test(df, 'OTC', 'dice_0.55', 'bilateral', 'unilateral', paired)
         print(f"  Within-subject difference: {ws_result['mean_diff']:.3f}")
         print(f"  p = {ws_result['p_ttest']:.4f}")
         
@@ -298,26 +368,33 @@ def test_group_comparisons(df):
     
     results = {}
     
-    for metric in ['accuracy_change', 'cross_temporal_mean']:
-        if metric not in df.columns:
-            continue
-            
+    metrics = [m for m in ['accuracy_change', 'cross_temporal_mean'] if m in df.columns]
+    cat_types = ['bilateral', 'unilateral']
+    groups = ['OTC', 'nonOTC', 'Control']
+    
+    # Bootstrap CIs of every (metric, category type, group) cell in one draw
+    cells = split_cells(df, ['category_type', 'group'])
+    keys = [(metric, cat_type, group) 
+            for metric in metrics for cat_type in cat_types for group in groups]
+    cell_vals = {(metric, cat_type, group): cell_values(cells, (cat_type, group), metric)
+                 for metric, cat_type, group in keys}
+    cell_cis = dict(zip(keys, bootstrap_ci([cell_vals[key] for key in keys])))
+    
+    for metric in metrics:
         print(f"\n--- {metric} ---")
         
-        for cat_type in ['bilateral', 'unilateral']:
+        for cat_type in cat_types:
             print(f"\n  {cat_type.upper()} categories:")
             
-            type_data = df[df['category_type'] == cat_type]
-            
-            for group in ['OTC', 'nonOTC', 'Control']:
-                group_vals = type_data[type_data['group'] == group][metric]
-                mean, low, high = bootstrap_ci(group_vals)
+            for group in groups:
+                group_vals = cell_vals[(metric, cat_type, group)]
+                mean, low, high = cell_cis[(metric, cat_type, group)]
                 n = group_vals.notna().sum()
                 print(f"    {group}: {mean:.3f} [{low:.3f}, {high:.3f}] (n={n})")
             
             # OTC vs Control comparison
-            otc_vals = type_data[type_data['group'] == 'OTC'][metric]
-            ctrl_vals = type_data[type_data['group'] == 'Control'][metric]
+            otc_vals = cell_vals[(metric, cat_type, 'OTC')]
+            ctrl_vals = cell_vals[(metric, cat_type, 'Control')]
             
             diff, p = bootstrap_diff_test(otc_vals, ctrl_vals)
             print(f"    OTC vs Control: diff = {diff:.3f}, p = {p:.4f}")
@@ -338,24 +415,25 @@ def test_category_specific(df):
     print("="*70)
     
     categories = df['category'].unique()
+    groups = ['OTC', 'nonOTC', 'Control']
+    metrics = [m for m in ['accuracy_change', 'cross_temporal_mean'] if m in df.columns]
     results = {}
     
+    # Bootstrap CIs of every (category, group, metric) cell in one draw
+    cells = split_cells(df, ['category', 'group'])
+    keys = [(category, group, metric) 
+            for category in categories for group in groups for metric in metrics]
+    cell_cis = dict(zip(keys, bootstrap_ci(
+        [cell_values(cells, (category, group), metric) for category, group, metric in keys])))
+    labels = {'accuracy_change': 'accuracy change', 'cross_temporal_mean': 'cross-temporal'}
+    
     for category in categories:
-        cat_data = df[df['category'] == category]
         print(f"\n--- {category.upper()} ---")
         
-        for group in ['OTC', 'nonOTC', 'Control']:
-            group_data = cat_data[cat_data['group'] == group]
-            
-            if 'accuracy_change' in group_data.columns:
-                acc_change = group_data['accuracy_change']
-                mean, low, high = bootstrap_ci(acc_change)
-                print(f"  {group} accuracy change: {mean:.3f} [{low:.3f}, {high:.3f}]")
-            
-            if 'cross_temporal_mean' in group_data.columns:
-                cross_temp = group_data['cross_temporal_mean']
-                mean, low, high = bootstrap_ci(cross_temp)
-                print(f"  {group} cross-temporal: {mean:.3f} [{low:.3f}, {high:.3f}]")
+        for group in groups:
+            for metric in metrics:
+                mean, low, high = cell_cis[(category, group, metric)]
+                print(f"  {group} {labels[metric]}: {mean:.3f} [{low:.3f}, {high:.3f}]")
     
     return results
 
@@ -373,41 +451,60 @@ def run_lmm_analyses(df):
     
     results = {}
     
+    # Shared design: the fixed-effects matrix and integer subject codes are
+    # built once (patsy parses the formula once); each model uses the rows
+    # where its outcome is present
+    design_df = df.dropna(subset=['category_type', 'group', 'subject'])
+    if len(design_df) == 0:
+        return results
+    exog = dmatrix("C(category_type) * C(group)", design_df, return_type='dataframe')
+    subject_codes = design_df['subject'].astype('category').cat.codes.to_numpy(np.int32)
+    
     # Model 1: Accuracy change ~ category_type + group, random intercept per subject
     print("\n--- Model: accuracy_change ~ category_type * group ---")
     
-    model_df = df.dropna(subset=['accuracy_change', 'category_type', 'group', 'subject'])
-    
-    if len(model_df) > 0:
-        try:
-            formula = "accuracy_change ~ C(category_type) * C(group)"
-            model = smf.mixedlm(formula, model_df, groups=model_df['subject'])
-            result = model.fit()
-            print(result.summary())
-            results['accuracy_change_lmm'] = result
-        except Exception as e:
-            print(f"Error: {e}")
+    result = _fit_lmm(design_df['accuracy_change'], exog, subject_codes)
+    if result is not None:
+        print(result.summary())
+        results['accuracy_change_lmm'] = result
     
     # Model 2: Cross-temporal ~ category_type + group
     if 'cross_temporal_mean' in df.columns:
         print("\n--- Model: cross_temporal_mean ~ category_type * group ---")
         
-        model_df = df.dropna(subset=['cross_temporal_mean', 'category_type', 'group', 'subject'])
-        
-        if len(model_df) > 0:
-            try:
-                formula = "cross_temporal_mean ~ C(category_type) * C(group)"
-                model = smf.mixedlm(formula, model_df, groups=model_df['subject'])
-                result = model.fit()
-                print(result.summary())
-                results['cross_temporal_lmm'] = result
-            except Exception as e:
-                print(f"Error: {e}")
+        result = _fit_lmm(design_df['cross_temporal_mean'], exog, subject_codes)
+        if result is not None:
+            print(result.summary())
+            results['cross_temporal_lmm'] = result
     
     return results
 
 
-def generate_summary_table(df):
+def _fit_lmm(endog, exog, groups):
+    """Random-intercept MixedLM of endog on a prebuilt design, warm-started from OLS
+    
+    Rows with a missing outcome are dropped (and with them any design
+    column that is then all zero, as re-running the formula would).
+    """
+    rows = endog.notna().to_numpy()
+    if not rows.any():
+        return None
+    
+    endog = endog[rows]
+    exog = exog[rows]
+    exog = exog.loc[:, (exog != 0).any()]
+    
+    try:
+        model = sm.MixedLM(endog, exog, groups=groups[rows])
+        ols_params = sm.OLS(endog, exog).fit().params.to_numpy()
+        start = MixedLMParams.from_components(fe_params=ols_params, cov_re=np.eye(1))
+        return model.fit(start_params=start)
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+
+def generate_summary_table(df, paired=None):
     """Generate summary table matching the ROI measures format from handoff"""
     
     print("\n" + "="*70)
@@ -415,45 +512,45 @@ def generate_summary_table(df):
     print("="*70)
     
     # Create summary for OTC patients only
-    otc_data = df[df['group'] == 'OTC']
+    cells = split_cells(df, ['group', 'category_type'])
+    if paired is None:
+        paired = build_paired_table(df)
     
-    rows = []
+    metrics = [m for m in ['accuracy_change', 'cross_temporal_mean', 'dice_0.55']
+               if m in df.columns and not df[m].isna().all()]
     
-    for metric in ['accuracy_change', 'cross_temporal_mean', 'dice_0.55']:
-        if metric not in df.columns or df[metric].isna().all():
-            continue
-        
-        bil = otc_data[otc_data['category_type'] == 'bilateral'][metric].dropna()
-        uni = otc_data[otc_data['category_type'] == 'unilateral'][metric].dropna()
-        
-        bil_mean = bil.mean() if len(bil) > 0 else np.nan
-        uni_mean = uni.mean() if len(uni) > 0 else np.nan
-        gap = bil_mean - uni_mean
-        
+    # OTC bilateral/unilateral means for every metric in one groupby
+    means = (df.loc[df['group'] == 'OTC']
+               .groupby('category_type', observed=True)[metrics].mean()
+               .reindex(['bilateral', 'unilateral']).T)
+    
+    p_within = []
+    p_vs_nonotc = []
+    for metric in metrics:
         # Within-subject test
-        ws_result = within_subject_test(df, 'OTC', metric, 'bilateral', 'unilateral')
+        ws_result = within_subject_test(df, 'OTC', metric, 'bilateral', 'unilateral', paired)
+        p_within.append(ws_result['p_ttest'])
         
         # Bootstrap comparison vs nonOTC
-        nonotc_bil = df[(df['group'] == 'nonOTC') & (df['category_type'] == 'bilateral')][metric]
+        bil = cell_values(cells, ('OTC', 'bilateral'), metric)
+        nonotc_bil = cell_values(cells, ('nonOTC', 'bilateral'), metric)
         diff, bootstrap_p = bootstrap_diff_test(bil, nonotc_bil)
-        
-        row = {
-            'Measure': metric,
-            'OTC_Bilateral': bil_mean,
-            'OTC_Unilateral': uni_mean,
-            'Gap': gap,
-            'p_within_subject': ws_result['p_ttest'],
-            'p_vs_nonOTC': bootstrap_p
-        }
-        rows.append(row)
+        p_vs_nonotc.append(bootstrap_p)
     
-    summary_df = pd.DataFrame(rows)
+    summary_df = pd.DataFrame({
+        'Measure': metrics,
+        'OTC_Bilateral': means['bilateral'].values,
+        'OTC_Unilateral': means['unilateral'].values,
+        'Gap': (means['bilateral'] - means['unilateral']).values,
+        'p_within_subject': p_within,
+        'p_vs_nonOTC': p_vs_nonotc
+    })
     
     print("\n" + summary_df.to_string(index=False))
     
     # Save
     summary_path = OUTPUT_DIR / 'summary_table.csv'
-    summary_df.to_csv(summary_path, index=False)
+    summary_df.to_csv(summary_path, index=False, float_format='%.4f')
     print(f"\nSaved to: {summary_path}")
     
     return summary_df
@@ -480,14 +577,17 @@ def main(results_path=None):
     # Run analyses
     results = {}
     
-    results['bilateral_vs_unilateral'] = test_bilateral_vs_unilateral(df)
+    # Subject x category-type means shared by the within-subject tests
+    paired = build_paired_table(df)
+    
+    results['bilateral_vs_unilateral'] = test_bilateral_vs_unilateral(df, paired)
     results['group_comparisons'] = test_group_comparisons(df)
     results['category_specific'] = test_category_specific(df)
     
     if STATSMODELS_AVAILABLE:
         results['lmm'] = run_lmm_analyses(df)
     
-    summary = generate_summary_table(df)
+    summary = generate_summary_table(df, paired)
     
     print("\n" + "="*70)
     print("ANALYSIS COMPLETE")
@@ -4,7 +4,7 @@
 #SBATCH --error=logs/sl_%A_%a.err
 #SBATCH --nodes=1
 #SBATCH --ntasks=1
-#SBATCH --cpus-per-task=1
+#SBATCH --cpus-per-task=8
 #SBATCH --mem=24G
 #SBATCH --time=02:00:00
 #SBATCH --array=0-24
@@ -15,18 +15,26 @@ Usage:
   python add_percondition_contrasts.py sub-004      # single subject
 """
 import os
+import re
 import sys
 import shutil
+import functools
 import subprocess
 import pandas as pd
 import numpy as np
+import nibabel as nib
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 
 data_dir = '/user_data/csimmon2/long_pt'
 CSV_FILE = '/user_data/csimmon2/git_repos/long_pt/long_pt_sub_info.csv'
 SUBJECTS_TO_EXCLUDE = ['sub-108']
 SESSION_START = {'sub-010': 2, 'sub-018': 2, 'sub-068': 2}
 
+# FSL binaries are single-threaded; launch up to this many at once
+# (also bounds how many cope volumes are held in memory together)
+N_WORKERS = os.cpu_count() or 1
+
 # New per-condition contrasts to add
 # (name, PE column index in 118-column design matrix)
 NEW_CONTRASTS = [
@@ -74,32 +82,40 @@ def get_runs(sub, ses):
 
 
 def read_design_con(con_file):
-    """Read existing design.con and return header info + matrix rows."""
+    """Read existing design.con and return header info + matrix rows.
+
+    Parsed files are memoized on (path, mtime, size), so a file that is
+    rewritten is parsed again.
+    """
+    st = os.stat(con_file)
+    return _parse_design_con(con_file, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_design_con(con_file, mtime_ns, size):
+    """Parse design.con with one split at /Matrix and regex header lookups."""
     with open(con_file, 'r') as f:
-        lines = f.readlines()
+        text = f.read()
 
-    # Parse header
-    header_lines = []
+    # Header is everything before the /Matrix line; blank lines after it
+    # also count as header, the rest are matrix rows
+    parts = re.split(r'^[ \t]*/Matrix[ \t]*(?:\n|$)', text, maxsplit=1, flags=re.M)
+    header_lines = parts[0].splitlines(keepends=True)
     matrix_lines = []
-    in_matrix = False
-    num_waves = None
-    num_contrasts = None
-
-    for line in lines:
-        stripped = line.strip()
-        if stripped == '/Matrix':
-            in_matrix = True
-            continue
-        if in_matrix and stripped:
-            matrix_lines.append(stripped)
-        else:
-            header_lines.append(line)
-            if stripped.startswith('/NumWaves'):
-                num_waves = int(stripped.split()[-1])
-            elif stripped.startswith('/NumContrasts'):
-                num_contrasts = int(stripped.split()[-1])
+    if len(parts) > 1:
+        for line in parts[1].splitlines(keepends=True):
+            if line.strip():
+                matrix_lines.append(line.strip())
+            else:
+                header_lines.append(line)
 
-    return header_lines, matrix_lines, num_waves, num_contrasts
+    header = ''.join(header_lines)
+    num_waves = re.findall(r'^[ \t]*/NumWaves.*?(\S+)[ \t]*$', header, flags=re.M)
+    num_contrasts = re.findall(r'^[ \t]*/NumContrasts.*?(\S+)[ \t]*$', header, flags=re.M)
+    num_waves = int(num_waves[-1]) if num_waves else None
+    num_contrasts = int(num_contrasts[-1]) if num_contrasts else None
+
+    return tuple(header_lines), tuple(matrix_lines), num_waves, num_contrasts
 
 
 def write_new_design_con(con_file, header_lines, matrix_lines, num_waves,
@@ -130,11 +146,12 @@ def write_new_design_con(con_file, header_lines, matrix_lines, num_waves,
         for row in matrix_lines:
             f.write(row + '\n')
 
-        # New per-condition contrast rows
+        # New per-condition contrast rows: splice the 1 into a zero template
+        # (every field is 12 chars + 1 space)
+        zero_row = '0.000000e+00 ' * num_waves + '\n'
         for name, col_idx in new_contrasts:
-            row = ['0.000000e+00'] * num_waves
-            row[col_idx] = '1.000000e+00'
-            f.write(' '.join(row) + ' \n')
+            start = col_idx * 13
+            f.write(zero_row[:start] + '1.000000e+00' + zero_row[start + 12:])
 
 
 def add_contrasts_to_feat(feat_dir):
@@ -145,6 +162,10 @@ def add_contrasts_to_feat(feat_dir):
     if not os.path.exists(con_file):
         return False
 
+    # contrast_mgr output for the last new contrast means this run is done
+    if os.path.exists(f'{feat_dir}/stats/cope19.nii.gz'):
+        return True
+
     # Check if already added
     header, matrix, num_waves, num_contrasts = read_design_con(con_file)
     if num_contrasts >= 19:
@@ -174,10 +195,25 @@ def run_contrast_mgr(feat_dir):
     return run_cmd(cmd)
 
 
+def load_stack(files):
+    """Load 3D volumes into one preallocated float32 4D array.
+
+    Returns the first image (for affine/header) and the stacked data.
+    """
+    ref_img = nib.load(files[0])
+    stack = np.empty(ref_img.shape + (len(files),), dtype=np.float32)
+    for i, f in enumerate(files):
+        img = ref_img if i == 0 else nib.load(f)
+        stack[..., i] = np.asarray(img.dataobj, dtype=np.float32)
+    return ref_img, stack
+
+
 def create_highlevel_cope(sub, ses, cope_num, runs, first_ses):
-    """Create HighLevel fixed-effects for a single cope using flameo.
+    """Create HighLevel fixed-effects for a single cope.
 
-    Merges run-level copes/varcopes into 4D, runs flameo with fixed effects.
+    With a single group-mean regressor, flameo's fixed-effects mode is the
+    precision-weighted mean of the run-level copes, so it is computed
+    in-process from the run-level cope/varcope images.
     """
     hl_dir = f'{data_dir}/{sub}/ses-{ses}/derivatives/fsl/loc/HighLevel.gfeat'
     cope_dir = f'{hl_dir}/cope{cope_num}.feat'
@@ -215,49 +251,35 @@ def create_highlevel_cope(sub, ses, cope_num, runs, first_ses):
                 mask = alt_mask
                 break
 
-    # Merge into 4D
-    tmp_cope4d = f'{stats_dir}/tmp_cope4d.nii.gz'
-    tmp_var4d = f'{stats_dir}/tmp_var4d.nii.gz'
-
-    run_cmd(f'fslmerge -t {tmp_cope4d} {" ".join(cope_files)}')
-    run_cmd(f'fslmerge -t {tmp_var4d} {" ".join(varcope_files)}')
-
-    # Create simple design for flameo (column of 1s, one group)
-    n_runs = len(cope_files)
-    design_mat = f'{stats_dir}/tmp_design.mat'
-    design_con = f'{stats_dir}/tmp_design.con'
-    design_grp = f'{stats_dir}/tmp_design.grp'
-
-    with open(design_mat, 'w') as f:
-        f.write(f'/NumWaves 1\n/NumPoints {n_runs}\n/PPheights 1\n/Matrix\n')
-        for _ in range(n_runs):
-            f.write('1\n')
-
-    with open(design_con, 'w') as f:
-        f.write('/ContrastName1 group_mean\n/NumWaves 1\n/NumContrasts 1\n')
-        f.write('/PPheights 1\n/RequiredEffect 1\n/Matrix\n1\n')
-
-    with open(design_grp, 'w') as f:
-        f.write(f'/NumWaves 1\n/NumPoints {n_runs}\n/Matrix\n')
-        for _ in range(n_runs):
-            f.write('1\n')
-
-    # Run flameo (fixed effects)
-    mask_arg = f'--mask={mask}' if os.path.exists(mask) else ''
-    cmd = (f'flameo --cope={tmp_cope4d} --vc={tmp_var4d} '
-           f'{mask_arg} --ld={stats_dir} '
-           f'--dm={design_mat} --tc={design_con} --cs={design_grp} '
-           f'--runmode=fe')
-
-    success = run_cmd(cmd)
+    try:
+        ref_img, cope4d = load_stack(cope_files)
+        _, var4d = load_stack(varcope_files)
+    except Exception as e:
+        print(f"    ERROR: {str(e)[:200]}")
+        return False
 
-    # flameo outputs pe1, cope1, varcope1, tstat1, zstat1 etc.
-    # Clean up temp files
-    for tmp in [tmp_cope4d, tmp_var4d, design_mat, design_con, design_grp]:
-        if os.path.exists(tmp):
-            os.remove(tmp)
+    # Fixed effects: w = 1/var, cope = sum(w*cope)/sum(w), var = 1/sum(w)
+    valid = np.all(var4d > 0, axis=-1)
+    if os.path.exists(mask):
+        valid &= np.asarray(nib.load(mask).dataobj, dtype=np.float32) > 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1.0 / var4d
+        w_sum = w.sum(axis=-1)
+        cope_fe = (w * cope4d).sum(axis=-1) / w_sum
+        var_fe = 1.0 / w_sum
+        z_fe = cope_fe / np.sqrt(var_fe)
+
+    # Same outputs flameo wrote (pe1 == cope1 for a single-EV design)
+    outputs = {'pe1': cope_fe, 'cope1': cope_fe, 'varcope1': var_fe,
+               'tstat1': z_fe, 'zstat1': z_fe}
+    for name, data in outputs.items():
+        data = np.where(valid, data, 0).astype(np.float32)
+        img = nib.Nifti1Image(data, ref_img.affine, ref_img.header)
+        img.set_data_dtype(np.float32)
+        img.to_filename(f'{stats_dir}/{name}.nii.gz')
 
-    return success
+    return True
 
 
 def register_highlevel_cope(sub, ses, cope_num, first_ses):
@@ -339,15 +361,23 @@ for _, row in df.iterrows():
 
         # Step 2: Run contrast_mgr for each run
         print(f"    Running contrast_mgr...")
-        for run in runs:
-            feat = f'{data_dir}/{sub}/ses-{ses}/derivatives/fsl/loc/run-{run}/1stLevel.feat'
-            if not run_contrast_mgr(feat):
+        feats = [f'{data_dir}/{sub}/ses-{ses}/derivatives/fsl/loc/run-{run}/1stLevel.feat'
+                 for run in runs]
+        with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+            results = list(executor.map(run_contrast_mgr, feats))
+        for run, ok in zip(runs, results):
+            if not ok:
                 print(f"    run-{run}: ⚠️ contrast_mgr failed")
 
         # Step 3: Create HighLevel fixed effects for new copes
         print(f"    Creating HighLevel fixed effects...")
-        for cope_num in range(15, 20):
-            if create_highlevel_cope(sub, ses, cope_num, runs, first_ses):
+        cope_nums = list(range(15, 20))
+        with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+            results = list(executor.map(
+                lambda c: create_highlevel_cope(sub, ses, c, runs, first_ses),
+                cope_nums))
+        for cope_num, ok in zip(cope_nums, results):
+            if ok:
                 cond = NEW_CONTRASTS[cope_num - 15][0]
                 print(f"    cope{cope_num} ({cond}): ✓")
             else:
@@ -14,6 +14,7 @@
 # - **Metrics**: Liu distinctiveness, geometry preservation, MDS shift, spatial drift
 
 # %% Cell 1: Setup & Configuration
+import functools
 import numpy as np
 import nibabel as nib
 from pathlib import Path
@@ -141,17 +142,59 @@ print(f"✓ {len(ALL_SUBJECTS)} subjects "
 # %% Cell 3: Core Utilities
 
 def create_sphere(center_mni, affine, shape, radius=6):
-    """Boolean mask for 6mm sphere around MNI coordinate."""
-    grid = np.array(np.meshgrid(
-        np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]),
-        indexing='ij'
-    )).reshape(3, -1).T
-    world = nib.affines.apply_affine(affine, grid)
-    dists = np.linalg.norm(world - center_mni, axis=1)
-    mask = np.zeros(shape, dtype=bool)
-    for c in grid[dists <= radius]:
-        mask[c[0], c[1], c[2]] = True
-    return mask
+    """Voxels of 6mm sphere around MNI coordinate.
+
+    Returns (box, local): `box` is a tuple of slices for the sphere's voxel
+    bounding box and `local` an (i, j, k) tuple of index arrays (C order)
+    into that box, so `data[box][local]` gathers the same voxels as a full
+    boolean mask would. Use sphere_values to read them from an image.
+
+    Spheres are memoized on the exact (affine, shape, centre, radius), so the
+    RSA and univariate extractors share one computation per session x ROI.
+    """
+    return _sphere_cached(np.asarray(affine, dtype=float).tobytes(), tuple(shape[:3]),
+                          np.asarray(center_mni, dtype=float).tobytes(), float(radius))
+
+
+@functools.lru_cache(maxsize=256)
+def _sphere_cached(affine_bytes, shape, center_bytes, radius):
+    """create_sphere on hashable arguments; the returned arrays are read-only."""
+    affine = np.frombuffer(affine_bytes).reshape(4, 4)
+    center_mni = np.frombuffer(center_bytes)
+    rzs, trans = affine[:3, :3], affine[:3, 3]
+    center_vox = np.linalg.solve(rzs, center_mni - trans)
+    # A world step of `radius` moves at most radius / (smallest singular
+    # value) voxels, so this half-width covers the sphere for any affine
+    k = int(np.ceil(radius / np.linalg.svd(rzs, compute_uv=False).min()))
+    axes = [np.arange(max(int(np.floor(c)) - k, 0), min(int(np.ceil(c)) + k + 1, n))
+            for c, n in zip(center_vox, shape)]
+    if any(len(a) == 0 for a in axes):
+        return ((slice(0, 0),) * 3, tuple(np.array([], dtype=np.intp) for _ in range(3)))
+
+    box = tuple(slice(a[0], a[-1] + 1) for a in axes)
+    ii, jj, kk = np.ix_(*axes)
+    d = (rzs[:, 0] * ii[..., None] + rzs[:, 1] * jj[..., None] + rzs[:, 2] * kk[..., None]
+         + (trans - center_mni))
+    local = np.nonzero(np.einsum('...i,...i', d, d) <= radius ** 2)
+    for idx in local:
+        idx.flags.writeable = False
+    return box, local
+
+
+@functools.lru_cache(maxsize=64)
+def open_img(path):
+    """Load an image header, keeping the file handle open for repeated slicing.
+
+    Cached by path, so search masks, zstats, PEs and copes opened by more than
+    one step are parsed once; cleared after each subject to release handles.
+    """
+    return nib.load(path, keep_file_open=True)
+
+
+def sphere_values(img, sphere):
+    """Image values inside a create_sphere sphere, reading only its bounding box."""
+    box, local = sphere
+    return np.asarray(img.dataobj[box], dtype=np.float32)[local]
 
 
 def get_highlevel_stat(sid, session, cope_num, first_session, stat='zstat1'):
@@ -246,8 +289,8 @@ def define_rois(sid, info, hemispheres, percentile=90, min_voxels=10):
             if not mask_file.exists():
                 continue
 
-            mask_img = nib.load(mask_file)
-            search_mask = mask_img.get_fdata() > 0
+            mask_img = open_img(mask_file)
+            search_mask = np.asarray(mask_img.dataobj, dtype=np.float32) > 0
             affine = mask_img.affine
             results[key] = {}
 
@@ -256,7 +299,7 @@ def define_rois(sid, info, hemispheres, percentile=90, min_voxels=10):
                 if not zstat_path.exists():
                     continue
 
-                zstat = nib.load(zstat_path).get_fdata()
+                zstat = np.asarray(open_img(zstat_path).dataobj, dtype=np.float32)
                 pos_vals = zstat[search_mask & (zstat > 0)]
                 if len(pos_vals) < min_voxels:
                     continue
@@ -292,6 +335,7 @@ all_rois = {}
 for sid, info in ALL_SUBJECTS.items():
     hemis = [info['hemi']] if info['is_patient'] else ['l', 'r']
     rois = define_rois(sid, info, hemis, percentile=ROI_PERCENTILE)
+    open_img.cache_clear()
     if rois:
         all_rois[sid] = rois
         n = sum(1 for v in rois.values() if v)
@@ -328,10 +372,19 @@ def extract_rsa_patterns(sid, info, roi_results, radius=6):
     if not ref_file:
         return {}
 
-    ref_img = nib.load(ref_file)
+    ref_img = open_img(ref_file)
     affine = ref_img.affine
     brain_shape = ref_img.shape
 
+    # Each session's PE images are opened once and sliced for every ROI
+    pe_imgs = {}
+    for ses in sessions:
+        pe_imgs[ses] = {}
+        for cat in CATEGORIES:
+            pe_path = get_pe_path(sid, ses, cat)
+            if pe_path.exists():
+                pe_imgs[ses][cat] = open_img(pe_path)
+
     roi_rdms = {}
 
     for roi_key, sessions_data in roi_results.items():
@@ -356,12 +409,10 @@ def extract_rsa_patterns(sid, info, roi_results, radius=6):
             valid_cats = []
 
             for cat in CATEGORIES:
-                pe_path = get_pe_path(sid, ses, cat)
-                if not pe_path.exists():
+                if cat not in pe_imgs[ses]:
                     continue
 
-                data = nib.load(pe_path).get_fdata()
-                betas = data[sphere]
+                betas = sphere_values(pe_imgs[ses][cat], sphere)
                 betas = betas[np.isfinite(betas)]
 
                 if len(betas) > 0:
@@ -397,6 +448,7 @@ for sid, info in ALL_SUBJECTS.items():
     if sid not in all_rois:
         continue
     rdms = extract_rsa_patterns(sid, info, all_rois[sid], SPHERE_RADIUS)
+    open_img.cache_clear()
     if rdms:
         all_rdms[sid] = rdms
         n_ses = sum(len(v['rdms']) for v in rdms.values())
@@ -444,7 +496,7 @@ def extract_univariate(sid, info, roi_results, radius=6):
                 if ref_file.exists():
                     break
 
-        ref_img = nib.load(ref_file)
+        ref_img = open_img(ref_file)
         affine = ref_img.affine
         brain_shape = ref_img.shape
 
@@ -460,8 +512,7 @@ def extract_univariate(sid, info, roi_results, radius=6):
             if not cope_path.exists():
                 continue
 
-            data = nib.load(cope_path).get_fdata()
-            vals = data[sphere]
+            vals = sphere_values(open_img(cope_path), sphere)
             vals = vals[np.isfinite(vals)]
 
             if len(vals) > 0:
@@ -482,6 +533,7 @@ for sid, info in ALL_SUBJECTS.items():
     if sid not in all_rois:
         continue
     univ = extract_univariate(sid, info, all_rois[sid], SPHERE_RADIUS)
+    open_img.cache_clear()
     if univ:
         all_univariate[sid] = univ
         n = sum(len(v) for v in univ.values())
@@ -5,10 +5,17 @@ Computing t-statistics from cope and varcope files
 """
 
 import os
+import itertools
 import numpy as np
 import pandas as pd
 import nibabel as nib
 from pathlib import Path
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+def _load_float32(path):
+    """Read a NIfTI volume straight to float32 (skips get_fdata's float64 copy)"""
+    return np.asarray(nib.load(path).dataobj, dtype=np.float32)
 
 class ContrastExtractor:
     def __init__(self, base_dir):
@@ -20,6 +27,9 @@ class ContrastExtractor:
             'sub-007': {'intact_hemi': 'left', 'sessions': ['01', '03', '04']},
             'sub-021': {'intact_hemi': 'left', 'sessions': ['01', '02', '03']}
         }
+        
+        # Per-subject mask voxel indices and world coordinates
+        self._mask_cache = {}
     
     def load_roi_mask(self, subject):
         """Load the ventral temporal ROI mask for this subject"""
@@ -31,23 +41,26 @@ class ContrastExtractor:
         
         return nib.load(roi_path)
     
-    def extract_voxel_data(self, stat_img, mask_img):
+    def get_mask_lookup(self, subject, affine):
+        """Voxel indices and world coordinates of the ROI mask, computed once per subject"""
+        lookup = self._mask_cache.get(subject)
+        if lookup is None:
+            mask_data = self.load_roi_mask(subject).get_fdata()
+            
+            # Get voxel indices where mask > 0
+            voxel_indices = np.where(mask_data > 0)
+            
+            # Convert to world coordinates
+            voxel_coords = np.column_stack(voxel_indices)
+            world_coords = nib.affines.apply_affine(affine, voxel_coords)
+            
+            lookup = {'indices': voxel_indices, 'world': world_coords}
+            self._mask_cache[subject] = lookup
+        return lookup
+    
+    def extract_voxel_data(self, stat_data, mask_lookup):
         """Extract coordinates and values for all voxels in mask"""
-        stat_data = stat_img.get_fdata()
-        mask_data = mask_img.get_fdata()
-        
-        # Get voxel indices where mask > 0
-        voxel_indices = np.where(mask_data > 0)
-        
-        # Convert to world coordinates
-        affine = stat_img.affine
-        voxel_coords = np.column_stack(voxel_indices)
-        world_coords = nib.affines.apply_affine(affine, voxel_coords)
-        
-        # Extract statistics for these voxels
-        stat_values = stat_data[voxel_indices]
-        
-        return world_coords, stat_values
+        return mask_lookup['world'], stat_data[mask_lookup['indices']]
     
     def extract_run_level_stats(self, subject, session, run, contrast_name):
         """Compute t-statistics from cope and varcope files"""
@@ -76,11 +89,9 @@ class ContrastExtractor:
             print(f"  Warning: Required files not found for {contrast_name}")
             return None
         
-        # Load data
-        cope1 = nib.load(cope1_file).get_fdata()
-        cope2 = nib.load(cope2_file).get_fdata()
-        varcope1 = nib.load(varcope1_file).get_fdata()
-        varcope2 = nib.load(varcope2_file).get_fdata()
+        # Load data - zlib releases the GIL, so the four decompressions overlap
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            cope1, cope2, varcope1, varcope2 = executor.map(_load_float32, required_files)
         
         # Compute contrast
         contrast = cope1 - cope2
@@ -103,9 +114,6 @@ class ContrastExtractor:
         """Extract and average t-statistics across runs for one session"""
         print(f"  Extracting {subject} ses-{session} {contrast_name}...")
         
-        # Load ROI mask
-        mask_img = self.load_roi_mask(subject)
-        
         # Determine available runs for this session
         if subject == 'sub-007' and session in ['03', '04']:
             runs = ['01', '02']
@@ -123,12 +131,18 @@ class ContrastExtractor:
             print(f"    No valid runs found for {subject} ses-{session}")
             return None
         
-        # Average across runs
-        avg_data = np.mean([img.get_fdata() for img in run_stats], axis=0)
-        avg_img = nib.Nifti1Image(avg_data, run_stats[0].affine, run_stats[0].header)
+        # Average across runs - accumulate in place rather than stacking volumes
+        if len(run_stats) == 1:
+            avg_data = np.asarray(run_stats[0].dataobj, dtype=np.float32)
+        else:
+            avg_data = np.zeros(run_stats[0].shape, dtype=np.float32)
+            for img in run_stats:
+                np.add(avg_data, np.asarray(img.dataobj, dtype=np.float32), out=avg_data)
+            avg_data /= len(run_stats)
         
-        # Extract voxel coordinates and values
-        coords, values = self.extract_voxel_data(avg_img, mask_img)
+        # ROI mask is only touched once there is something to extract
+        mask_lookup = self.get_mask_lookup(subject, run_stats[0].affine)
+        coords, values = self.extract_voxel_data(avg_data, mask_lookup)
         
         # Create dataframe
         df = pd.DataFrame({
@@ -142,56 +156,74 @@ class ContrastExtractor:
         })
         
         print(f"    Extracted {len(df)} voxels (min: {values.min():.2f}, max: {values.max():.2f}, mean: {values.mean():.2f})")
-        return df
+        return df, (coords, values)
     
     def extract_all_sessions(self, subject, contrast_name):
-        """Extract data for all sessions of one subject"""
+        """Extract data for all sessions of one subject
+        
+        Returns the combined dataframe and a {session: (coords, values)} dict
+        of the raw arrays, or (None, None) if no session had data.
+        """
         all_data = []
+        session_arrays = {}
         
         for session in self.subjects_info[subject]['sessions']:
-            df = self.extract_session_data(subject, session, contrast_name)
-            if df is not None:
+            result = self.extract_session_data(subject, session, contrast_name)
+            if result is not None:
+                df, session_arrays[session] = result
                 all_data.append(df)
         
         if not all_data:
-            return None
+            return None, None
         
-        return pd.concat(all_data, ignore_index=True)
+        return pd.concat(all_data, ignore_index=True), session_arrays
     
-    def save_output(self, df, subject, contrast_name, output_dir):
+    def save_output(self, df, session_arrays, subject, contrast_name, output_dir):
         """Save extracted data"""
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save as CSV
-        csv_file = output_dir / f'{subject}_{contrast_name}_FGOTS.csv'
-        df.to_csv(csv_file, index=False)
-        print(f"Saved {csv_file}")
+        # Save as Parquet (typed, compressed columns; much faster than CSV)
+        parquet_file = output_dir / f'{subject}_{contrast_name}_FGOTS.parquet'
+        df.to_parquet(parquet_file, engine='pyarrow', compression='zstd', index=False)
+        print(f"Saved {parquet_file}")
         
-        # Save session-specific arrays
-        for session in df['session'].unique():
-            session_data = df[df['session'] == session][['x', 'y', 'z', 't_stat']].values
+        # Save session-specific arrays, written straight from the raw
+        # (coords, values) arrays rather than filtering the dataframe
+        for session, (coords, values) in session_arrays.items():
             npy_file = output_dir / f'{subject}_ses{session}_{contrast_name}_FGOTS.npy'
-            np.save(npy_file, session_data)
+            session_data = np.lib.format.open_memmap(npy_file, mode='w+', dtype=np.float32,
+                                                     shape=(len(values), 4))
+            session_data[:, :3] = coords
+            session_data[:, 3] = values
+            session_data.flush()
+            del session_data
             print(f"Saved {npy_file}")
 
+def _process_subject_contrast(task):
+    """Extract and save one (subject, contrast) pair; runs in a worker process"""
+    base_dir, output_dir, subject, contrast_name = task
+    print(f"\nProcessing {subject} / {contrast_name}...")
+    
+    extractor = ContrastExtractor(base_dir)
+    df, session_arrays = extractor.extract_all_sessions(subject, contrast_name)
+    
+    if df is not None:
+        extractor.save_output(df, session_arrays, subject, contrast_name, output_dir)
+
 def main():
     base_dir = '/user_data/csimmon2/long_pt'
     output_dir = Path(base_dir) / 'analyses' / 'fgots_extraction'
     
-    extractor = ContrastExtractor(base_dir)
+    subjects = ['sub-004', 'sub-007', 'sub-021']
+    contrasts = ['face_word', 'object_house']
     
-    # Extract for each subject and contrast
-    for subject in ['sub-004', 'sub-007', 'sub-021']:
-        print(f"\nProcessing {subject}...")
-        
-        for contrast_name in ['face_word', 'object_house']:
-            print(f"  Contrast: {contrast_name}")
-            
-            df = extractor.extract_all_sessions(subject, contrast_name)
-            
-            if df is not None:
-                extractor.save_output(df, subject, contrast_name, output_dir)
+    # Each (subject, contrast) pair is independent - fan out across cores
+    tasks = [(base_dir, output_dir, subject, contrast_name)
+             for subject, contrast_name in itertools.product(subjects, contrasts)]
+    
+    with Pool(min(len(tasks), os.cpu_count() or 1)) as pool:
+        pool.map(_process_subject_contrast, tasks)
     
     print("\nExtraction complete!")
     print(f"Results saved to: {output_dir}")